@@ -1,10 +1,8 @@
 class long(int):
+    ''' int encoded as java long, import it with `from dubbo.codec.hessian2 import long` '''
     pass
 
 
 class double(float):
+    ''' float encoded as java double '''
     pass
-
-
-__builtins__['long'] = long  # add long to builtin
-__builtins__['double'] = double  # add double to builtin
@@ -1,88 +1,625 @@
+import math
 import time
+import heapq
 import socket
+import asyncio
 import logging
+import selectors
 import itertools
-from queue import Queue
-from threading import Thread
+from concurrent.futures import Future, TimeoutError
+from queue import Queue, SimpleQueue, Empty, Full
+from threading import Thread, Lock, current_thread
 from .codec.hessian2 import Decoder, DubboRequest, DubboHeartBeatRequest, DubboHeartBeatResponse
+from .utils import bytes_to_int
 
 
-__all__ = ('DubboClient', )
+__all__ = ('DubboClient', 'DubboClientPool', 'AsyncDubboClient')
+
+
+logger = logging.getLogger(__name__)
+
+
+_SEND_BATCH = 64  # max buffers flushed by one sendmsg call
+_RECV_BUFFER_SIZE = 1 << 20
+_HEARTBEAT_INTERVAL = 60
+_RTT_ALPHA = 0.125  # weight of the latest sample in rtt mean and variance
+_HEADER_LENGTH = 16
+_DUBBO_MAGIC = b'\xda\xbb'
+_DUBBO_END = b'\r\ndubbo>'
+_LF = b'\n'
+_CRLF = b'\r\n'
+_LS_PREFIX = b'ls '
+_LS_COMMAND = b'ls\n'
+
+
+class _FrameError(Exception):
+    ''' a received frame failed to decode, id is the request id in its header '''
+    def __init__(self, id_):
+        super().__init__(id_)
+        self.id = id_
+
+
+class _Reactor(object):
+    ''' single thread serving socket events and timers of all DubboClient instances '''
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def get(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._timers = []  # heap of [deadline, seq, callback, args]
+        self._timer_seq = itertools.count()
+        self._lock = Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def call_soon(self, callback, *args):
+        ''' run callback in reactor thread, thread safe '''
+        self.call_later(0, callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        ''' run callback in reactor thread after delay seconds, thread safe '''
+        with self._lock:
+            heapq.heappush(self._timers, [time.monotonic() + delay, next(self._timer_seq), callback, args])
+        if current_thread() is not self._thread:
+            try:
+                self._wakeup_w.send(b'\x00')
+            except OSError:  # wakeup already pending
+                pass
+
+    def register(self, sock, on_readable, on_writable):
+        self.call_soon(self._selector.register, sock, selectors.EVENT_READ, (on_readable, on_writable))
+
+    def unregister(self, sock, close=False):
+        ''' thread safe, done at once in reactor thread '''
+        if current_thread() is self._thread:
+            self._unregister(sock, close)
+        else:
+            self.call_soon(self._unregister, sock, close)
+
+    def _unregister(self, sock, close):
+        self._selector.unregister(sock)
+        if close:
+            sock.close()
+
+    def watch(self, sock, events):
+        ''' change selector events of sock, reactor thread only '''
+        key = self._selector.get_key(sock)
+        self._selector.modify(sock, events, key.data)
+
+    def _run(self):
+        while True:
+            timeout = self._run_timers()
+            for key, events in self._selector.select(timeout):
+                if key.data is None:  # wakeup
+                    self._drain_wakeup()
+                    continue
+                on_readable, on_writable = key.data
+                if events & selectors.EVENT_READ:
+                    self._run_callback(on_readable)
+                if events & selectors.EVENT_WRITE:
+                    self._run_callback(on_writable)
+
+    def _run_timers(self):
+        ''' run expired timers, return seconds until next timer, None if there is no timer '''
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                ready.append(heapq.heappop(self._timers))
+        for _, _, callback, args in ready:
+            self._run_callback(callback, *args)
+        with self._lock:
+            if not self._timers:
+                return None
+            return max(0, self._timers[0][0] - time.monotonic())
+
+    def _run_callback(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception('error in reactor callback %s', callback)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
 
 
 class DubboClient(object):
-    _timeout = 5  # recv timeout set to 5sec
+    _timeout = 5  # recv timeout set to 5sec, also the lower bound of rtt based timeout
+    _max_timeout = 30  # upper bound of rtt based timeout
 
-    def __init__(self, host, port, dubbo_version='2.5.3'):
+    def __init__(self, host, port, dubbo_version='2.5.3', tcp_nodelay=True, keepalive=True, sndbuf=None, rcvbuf=None, rtt_safety=4.0):
+        ''' sndbuf/rcvbuf: socket buffer sizes, None keeps kernel auto tuning
+            rtt_safety: response timeout of a method slower than _timeout is rtt mean + rtt_safety * rtt deviation, None to always use _timeout
+        '''
+        self._rtt_safety = rtt_safety
+        self._rtt = {}  # {(service, method): [rtt mean, rtt variance]}
+        self._rtt_lock = Lock()
         self._host = host
         self._port = port
         self._dubbo_version = dubbo_version
         self._request_id = itertools.count(1)
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._set_sockopts(tcp_nodelay, keepalive, sndbuf, rcvbuf)
         self._sock.connect((self._host, self._port))
-        self._msg_queue = Queue()
-        Thread(target=self._recv_loop, daemon=True).start()
-        Thread(target=self._heartbeat_loop, daemon=True).start()
+        self._sock.setblocking(False)
+        self._pending = {}  # {request id: Future}
+        self._pending_lock = Lock()
+        self._cmd_queue = Queue(maxsize=1)  # telnet replies carry no request id
+        self._send_q = SimpleQueue()
+        self._out = []  # memoryviews waiting for socket writable, reactor thread only
+        self._flush_scheduled = False
+        self._events = selectors.EVENT_READ  # selector events watched for the socket, reactor thread only
+        self._rbuf = bytearray(_RECV_BUFFER_SIZE)
+        self._rview = memoryview(self._rbuf)
+        self._rpos = self._wpos = 0  # unread bytes are self._rbuf[self._rpos:self._wpos]
+        self._need = 0  # bytes required by the message at self._rpos
+        self._last_send_ts = self._last_recv_ts = time.monotonic()
+        self._closed = False
+        self._handlers = {  # {message type: handler}, decoded messages are never subclassed
+            DubboHeartBeatRequest: self._on_heartbeat_request,
+            DubboHeartBeatResponse: self._on_heartbeat_response,
+            bytes: self._on_command_reply,  # telnet command reply
+        }
+        self._reactor = _Reactor.get()
+        self._heartbeat_started = False  # started by first flush, reactor thread only
+        self._reactor.register(self._sock, self._handle_read, self._handle_write)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-    def _recv_loop(self):
+    def close(self):
+        ''' close connection, requests still waiting for response fail with EOFError
+            data already sent is flushed before the socket is closed
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._reactor.call_soon(self._flush)  # _handle_write closes the socket once output is drained
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            fut.set_exception(EOFError())
+
+    def _set_sockopts(self, tcp_nodelay, keepalive, sndbuf, rcvbuf):
+        # set before connect, receive window scale is negotiated in handshake
+        sock = self._sock
+        if tcp_nodelay:  # batching is done by _flush, not Nagle
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for opt, size in ((socket.SO_SNDBUF, sndbuf), (socket.SO_RCVBUF, rcvbuf)):
+            if size is None:
+                continue
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, opt, size)
+            except OSError as err:
+                logger.warning('unable to set socket buffer size %d: "%s"', size, err)
+
+    def _handle_read(self):
+        if self._closed:
+            return
+        try:
+            received = self._recv_into_buffer()
+        except BlockingIOError:
+            return
+        except OSError as err:
+            logger.warning('recv error "%s"', err)
+            received = 0
+        if not received:
+            logger.warning('got EOF error, stop receiving!')
+            self.close()
+            return
+        self._dispatch_messages()
+        self._compact_buffer()
+
+    def _dispatch_messages(self):
+        ''' handle all complete messages in receive buffer, an undecodable frame fails only its own request '''
         while True:
             try:
-                msg = Decoder(self._sock).decode()
-            except EOFError:
-                logging.warn('got EOF error, stop recv loop!')
-                return
-            if isinstance(msg, DubboHeartBeatRequest):
-                if msg.is_twoway():
-                    logging.debug('reply heartbeat message')
-                    self.send_heartbeat_response(msg.id)
-                else:
-                    logging.warn('skip heartbeat request message not twoway.')
+                msg = self._pop_message()
+            except _FrameError as err:
+                logger.warning('skip undecodable frame of request "%s": "%s"', err.id, err.__cause__)
+                self._on_frame_error(err.id, err.__cause__)
                 continue
-            elif isinstance(msg, DubboHeartBeatResponse):
-                logging.warn('skip heartbeat response message')
-                continue
-            self._msg_queue.put(msg)
+            if msg is None:
+                break
+            self._handlers.get(type(msg), self._on_response)(msg)
+
+    def _recv_into_buffer(self):
+        received = self._sock.recv_into(self._rview[self._wpos:])
+        self._wpos += received
+        self._last_recv_ts = time.monotonic()
+        return received
 
-    def _heartbeat_loop(self):
+    def _pop_message(self):
+        ''' pop next complete message from receive buffer, None if it is not fully received '''
+        rpos, wpos = self._rpos, self._wpos
+        if wpos - rpos < 2:
+            self._need = 2
+            return None
+        if self._rview[rpos:rpos + 2] != _DUBBO_MAGIC:  # telnet command reply
+            end = self._rbuf.find(_DUBBO_END, rpos, wpos)
+            if end < 0:
+                self._need = wpos - rpos + 1
+                return None
+            end += len(_DUBBO_END)
+            msg = bytes(self._rview[rpos:end])
+        else:
+            if wpos - rpos < _HEADER_LENGTH:
+                self._need = _HEADER_LENGTH
+                return None
+            end = rpos + _HEADER_LENGTH + bytes_to_int(self._rview[rpos + 12:rpos + _HEADER_LENGTH])
+            if end > wpos:
+                self._need = end - rpos
+                return None
+            self._rpos = end  # skip the frame even if it fails to decode
+            try:
+                return Decoder.decode_frame(self._rview[rpos:rpos + _HEADER_LENGTH], self._rview[rpos + _HEADER_LENGTH:end])
+            except Exception as err:
+                raise _FrameError(bytes_to_int(self._rview[rpos + 4:rpos + 12])) from err
+        self._rpos = end
+        return msg
+
+    def _compact_buffer(self):
+        ''' move pending bytes to buffer head, grow buffer if next message doesn't fit '''
+        rpos, wpos = self._rpos, self._wpos
+        if rpos == wpos:
+            self._rpos = self._wpos = 0
+            return
+        size = len(self._rbuf)
+        if self._need > size:  # message larger than buffer
+            rbuf = bytearray(max(size * 2, self._need))
+            rbuf[:wpos - rpos] = self._rview[rpos:wpos]
+            self._rbuf, self._rview = rbuf, memoryview(rbuf)
+        elif rpos > size // 2 or rpos + self._need > size:
+            self._rbuf[:wpos - rpos] = bytes(self._rview[rpos:wpos])
+        else:
+            return
+        self._rpos, self._wpos = 0, wpos - rpos
+
+    def _on_heartbeat_request(self, msg):
+        if msg.is_twoway():
+            logger.debug('reply heartbeat message')
+            self.send_heartbeat_response(msg.id)
+        else:
+            logger.warning('skip heartbeat request message not twoway.')
+
+    def _on_heartbeat_response(self, msg):
+        logger.warning('skip heartbeat response message')
+
+    def _on_command_reply(self, msg):
+        try:
+            self._cmd_queue.put_nowait(msg)  # the reactor thread is shared by all clients, never block it
+        except Full:
+            logger.warning('skip command reply "%s" nobody is waiting for', msg)
+
+    def _on_response(self, msg):
+        with self._pending_lock:
+            fut = self._pending.pop(msg.id, None)
+        if fut is None:
+            logger.warning('skip response "%s" without pending request', msg.id)
+            return
+        fut.set_result(msg)
+
+    def _on_frame_error(self, id_, err):
+        with self._pending_lock:
+            fut = self._pending.pop(id_, None)
+        if fut is not None:
+            fut.set_exception(err)
+
+    def _send(self, data):
+        if self._closed:
+            raise EOFError('connection closed')
+        self._last_send_ts = time.monotonic()
+        self._send_q.put(data)
+        if not self._flush_scheduled:  # one flush serves all data queued before it runs
+            self._flush_scheduled = True
+            self._reactor.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._heartbeat_started and not self._closed:  # idle clients never sending anything need no heartbeat
+            self._heartbeat_started = True
+            self._reactor.call_later(_HEARTBEAT_INTERVAL, self._heartbeat)
         while True:
-            time.sleep(60)
             try:
-                logging.debug('send heartbeat msg to provider')
-                self.send_heartbeat_request(next(self._request_id))
-            except EOFError:
-                logging.warn('got EOF error, stop heartbeat loop!')
+                self._out.append(memoryview(self._send_q.get_nowait()))
+            except Empty:
+                break
+        self._handle_write()
+
+    def _handle_write(self):
+        ''' write pending buffers, up to _SEND_BATCH of them per sendmsg call '''
+        if self._sock.fileno() < 0:  # closed after output of close() drained
+            return
+        out = self._out
+        while out:
+            batch = out[:_SEND_BATCH]
+            try:
+                sent = self._sock.sendmsg(batch)
+            except BlockingIOError:
+                break
+            except OSError as err:
+                logger.warning('send error "%s"', err)
+                out.clear()
+                break
+            done = 0
+            while done < len(batch) and sent >= len(batch[done]):  # drop buffers fully sent
+                sent -= len(batch[done])
+                done += 1
+            del out[:done]
+            if sent:  # short write, re-slice the partially sent buffer
+                out[0] = out[0][sent:]
+        self._update_events()
+
+    def _update_events(self):
+        ''' watch writable while output is pending, close the socket of a closed client once it is drained '''
+        out = self._out
+        if self._closed and not out:
+            if not self._send_q.empty():  # queued while this flush was writing, close() came after
+                self._flush()
                 return
+            self._reactor.unregister(self._sock, close=True)
+            return
+        events = selectors.EVENT_WRITE if out else 0
+        if not self._closed:  # a closed client only waits to flush, unread input must not wake the reactor
+            events |= selectors.EVENT_READ
+        if events != self._events:
+            self._events = events
+            self._reactor.watch(self._sock, events)
+
+    def _heartbeat(self):
+        ''' send heartbeat only after the connection has been idle for a whole interval '''
+        if self._closed:
+            return
+        idle = time.monotonic() - max(self._last_send_ts, self._last_recv_ts)
+        if idle >= _HEARTBEAT_INTERVAL:
+            logger.debug('send heartbeat msg to provider')
+            self.send_heartbeat_request(next(self._request_id))
+            idle = 0
+        self._reactor.call_later(_HEARTBEAT_INTERVAL - idle, self._heartbeat)
 
     def get_services(self):
-        command = 'ls'
-        return self._execute_command(command)
+        return self._execute_command(_LS_COMMAND)
 
     def get_methods(self, service_name):
-        command = ''.join(['ls ', service_name])
-        return self._execute_command(command)
+        return self._execute_command(_LS_PREFIX + service_name.encode() + _LF)
 
     def _execute_command(self, command):
-        command += '\n'
-        self._sock.sendall(command.encode())
-        return self._msg_queue.get().decode().split('\r\n')[:-1]
+        self._send(command)
+        lines = self._cmd_queue.get().split(_CRLF)
+        lines.pop()  # trailing dubbo> prompt
+        return [line.decode() for line in lines]
 
     def send_heartbeat_request(self, id_):
-        self._sock.sendall(DubboHeartBeatRequest(id_).encode())
+        self._send(DubboHeartBeatRequest(id_).encode())
 
     def send_heartbeat_response(self, id_):
-        self._sock.sendall(DubboHeartBeatResponse(id_).encode())
+        self._send(DubboHeartBeatResponse(id_).encode())
 
     def send_request_without_response(self, **kwargs):
-        self._sock.sendall(DubboRequest(
+        self._send(DubboRequest(
             id=next(self._request_id),
             twoway=False,
             dubbo_version=self._dubbo_version,
             **kwargs).encode())
 
+    def send_request_and_return_response(self, timeout=None, **kwargs):
+        ''' timeout: seconds to wait for response, None to derive it from observed rtt of the method
+            raise concurrent.futures.TimeoutError if no response in time
+        '''
+        key = (kwargs.get('service_name'), kwargs.get('method_name'))
+        sample_rtt = timeout is None  # a timeout given by caller says nothing about the method's rtt
+        if sample_rtt:
+            timeout = self._get_timeout(key)
+        id_ = next(self._request_id)
+        fut = Future()
+        with self._pending_lock:
+            self._pending[id_] = fut
+        start = time.monotonic()
+        try:
+            self._send(DubboRequest(
+                id=id_,
+                twoway=True,
+                dubbo_version=self._dubbo_version,
+                **kwargs).encode())
+            resp = fut.result(timeout)
+        except TimeoutError:
+            if sample_rtt:
+                self._update_rtt(key, timeout * 2)  # back off, or a slowed down method keeps timing out
+            raise
+        finally:
+            with self._pending_lock:
+                self._pending.pop(id_, None)
+        if sample_rtt:
+            self._update_rtt(key, time.monotonic() - start)
+        return resp
+
+    def _get_timeout(self, key):
+        ''' mean + rtt_safety * deviation of the method rtt, between _timeout and _max_timeout '''
+        stat = self._rtt.get(key)
+        if stat is None or self._rtt_safety is None:
+            return self._timeout
+        mean, var = stat
+        return min(self._max_timeout, max(self._timeout, mean + self._rtt_safety * math.sqrt(var)))
+
+    def _update_rtt(self, key, rtt):
+        ''' update exponentially weighted mean and variance of the method rtt '''
+        with self._rtt_lock:
+            stat = self._rtt.get(key)
+            if stat is None:
+                self._rtt[key] = [rtt, (rtt / 2) ** 2]
+                return
+            mean, var = stat
+            diff = rtt - mean
+            stat[0] = mean + _RTT_ALPHA * diff
+            stat[1] = (1 - _RTT_ALPHA) * (var + _RTT_ALPHA * diff * diff)
+
+
+class DubboClientPool(object):
+    ''' spread requests to one provider over several DubboClient connections, round robin '''
+    def __init__(self, host, port, size=8, **kwargs):
+        self._clients = []
+        try:
+            for _ in range(size):
+                self._clients.append(DubboClient(host, port, **kwargs))
+        except Exception:
+            self.close()  # or connected clients stay registered on the reactor
+            raise
+        self._rr = itertools.cycle(self._clients)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for client in self._clients:
+            client.close()
+
+    def get_for_key(self, key):
+        ''' get the client pinned to key, requests sent through it keep their order '''
+        return self._clients[hash(key) % len(self._clients)]
+
+    def get_services(self):
+        return next(self._rr).get_services()
+
+    def get_methods(self, service_name):
+        return next(self._rr).get_methods(service_name)
+
+    def send_request_without_response(self, **kwargs):
+        return next(self._rr).send_request_without_response(**kwargs)
+
     def send_request_and_return_response(self, **kwargs):
-        self._sock.sendall(DubboRequest(
+        return next(self._rr).send_request_and_return_response(**kwargs)
+
+
+class AsyncDubboClient(object):
+    ''' asyncio version of DubboClient, one connection shared by all coroutines
+
+        client = await AsyncDubboClient('127.0.0.1', 12358).connect()
+        resp = await client.send_request_and_return_response(service_name='calc', method_name='exp', args=[4])
+    '''
+    _timeout = 5  # response timeout set to 5sec
+
+    def __init__(self, host, port, dubbo_version='2.5.3'):
+        self._host = host
+        self._port = port
+        self._dubbo_version = dubbo_version
+        self._request_id = itertools.count(1)
+        self._pending = {}  # {request id: asyncio.Future}
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._recv_loop()), loop.create_task(self._heartbeat_loop())]
+        return self
+
+    async def close(self):
+        ''' close connection, requests still waiting for response fail with EOFError '''
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._writer.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _recv_loop(self):
+        try:
+            while True:
+                try:
+                    msg = await self._read_message()
+                except _FrameError as err:
+                    logger.warning('skip undecodable frame of request "%s": "%s"', err.id, err.__cause__)
+                    self._set_result(err.id, exception=err.__cause__)
+                    continue
+                except (asyncio.IncompleteReadError, ConnectionError, EOFError):
+                    logger.warning('got EOF error, stop recv loop!')
+                    break
+                self._dispatch(msg)
+        finally:  # on EOF and on close()
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(EOFError())
+
+    def _dispatch(self, msg):
+        if isinstance(msg, DubboHeartBeatRequest):
+            if msg.is_twoway():
+                logger.debug('reply heartbeat message')
+                self._writer.write(DubboHeartBeatResponse(msg.id).encode())
+        elif not isinstance(msg, DubboHeartBeatResponse):
+            self._set_result(msg.id, result=msg)
+
+    def _set_result(self, id_, result=None, exception=None):
+        fut = self._pending.pop(id_, None)
+        if fut is None or fut.done():
+            return
+        if exception is None:
+            fut.set_result(result)
+        else:
+            fut.set_exception(exception)
+
+    async def _read_message(self):
+        header = await self._reader.readexactly(_HEADER_LENGTH)
+        if header[:2] != _DUBBO_MAGIC:
+            raise EOFError('got non dubbo message "%s"' % header)
+        body = await self._reader.readexactly(bytes_to_int(header[12:16]))
+        try:
+            return Decoder.decode_frame(header, body)
+        except Exception as err:
+            raise _FrameError(bytes_to_int(header[4:12])) from err
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(_HEARTBEAT_INTERVAL)
+            logger.debug('send heartbeat msg to provider')
+            self._writer.write(DubboHeartBeatRequest(next(self._request_id)).encode())
+
+    async def send_request_without_response(self, **kwargs):
+        self._writer.write(DubboRequest(
             id=next(self._request_id),
+            twoway=False,
+            dubbo_version=self._dubbo_version,
+            **kwargs).encode())
+        await self._writer.drain()
+
+    async def send_request_and_return_response(self, **kwargs):
+        id_ = next(self._request_id)
+        fut = asyncio.get_event_loop().create_future()
+        self._pending[id_] = fut
+        self._writer.write(DubboRequest(
+            id=id_,
             twoway=True,
             dubbo_version=self._dubbo_version,
             **kwargs).encode())
-        return self._msg_queue.get(True, self._timeout)
+        try:
+            await self._writer.drain()
+            return await asyncio.wait_for(fut, self._timeout)
+        finally:
+            self._pending.pop(id_, None)
@@ -1,11 +1,21 @@
-import re
+''' Hessian2 codec of Dubbo messages
+
+Encoding and decoding cost is python interpreter overhead: bytecode dispatch, small bytes
+allocations and method lookups, not arithmetic. There is no numeric array work for SIMD or
+GPU style tuning, so keep the hot paths shaped around the interpreter instead:
+    - decode tags through the 256 entries reader tables, not if/elif chains
+    - read bodies through _Cursor slices and precompiled struct.Struct objects
+    - encode by appending to one bytearray, never by concatenating bytes
+    - cache anything derived from class names or method descriptors
+'''
 import struct
 import logging
 import binascii
+import functools
 from io import BytesIO
 from collections import namedtuple
-from ..utils import int_to_bytes, bytes_to_int, bytes_to_long, double_to_bytes, \
-    bytes_to_double, timestamp_to_datetime, long_to_bytes
+from .. import long, double
+from ..utils import int_to_bytes, double_to_bytes, timestamp_to_datetime, UINT8, UINT16, UINT32, UINT64, INT8, INT16, INT32, INT64, DOUBLE
 from ..java_class import JavaList, java_typed_data_to_python
 
 
@@ -26,6 +36,15 @@ _BC_LONG_INT = 0x59
 _BC_REF = 0x51
 _BC_INT_ZERO = 0x90
 
+_B_DOUBLE_ZERO = bytes([_BC_DOUBLE_ZERO])
+_B_DOUBLE_ONE = bytes([_BC_DOUBLE_ONE])
+_B_DOUBLE_BYTE = bytes([_BC_DOUBLE_BYTE])
+_B_DOUBLE_SHORT = bytes([_BC_DOUBLE_SHORT])
+_B_DOUBLE_MILL = bytes([_BC_DOUBLE_MILL])
+_B_LONG_INT = bytes([_BC_LONG_INT])
+_B_RESPONSE_VALUE = bytes([_BC_INT_ZERO + 1])  # see DecodeableRpcResult.java
+_B_RESPONSE_NULL_VALUE = bytes([_BC_INT_ZERO + 2])
+
 _BS_STRING = ord(b'S')
 _BS_STRING_TRUNK = ord(b'R')
 
@@ -46,6 +65,10 @@ _SHORT_LONG = range(0x38, 0x3f + 1)
 _ZERO_BYTE = range(0x00, 0x1f + 1)
 
 
+# utf-8 sequence length by lead byte, stray continuation bytes count as one and fail in decode()
+_UTF8_LENGTHS = bytes([1] * 0x80 + [1] * 0x40 + [2] * 0x20 + [3] * 0x10 + [4] * 0x08 + [1] * 0x08)
+
+
 _FLAG_REQUEST = 0x80
 _FLAG_RESPONSE = 0x00
 _FLAG_TWOWAY = 0x40
@@ -54,12 +77,78 @@ _SERIALIZATION_MASK = 0x1f
 _HESSIAN2_SERIALIZATION_ID = 0x02
 
 
+class _Cursor(object):
+    ''' read position over an in-memory message body '''
+    __slots__ = ('buf', 'pos')
+
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self.pos = pos
+
+    def read(self, length):
+        pos = self.pos
+        end = pos + length
+        if end > len(self.buf):
+            raise EOFError
+        self.pos = end
+        return self.buf[pos:end]
+
+    def read_byte(self):
+        ''' read one byte as int '''
+        pos = self.pos
+        try:
+            value = self.buf[pos]
+        except IndexError:
+            raise EOFError
+        self.pos = pos + 1
+        return value
+
+    def unpack(self, struct_):
+        ''' unpack the single value of a precompiled struct at the cursor '''
+        pos = self.pos
+        end = pos + struct_.size
+        if end > len(self.buf):
+            raise EOFError
+        self.pos = end
+        return struct_.unpack_from(self.buf, pos)[0]
+
+
+class _StreamReader(object):
+    ''' exact length reads over a socket or file-like stream, which may return short chunks '''
+    __slots__ = ('_read_func',)
+
+    def __init__(self, stream):
+        self._read_func = hasattr(stream, 'recv') and stream.recv or stream.read
+
+    def read(self, length):
+        chunk = self._read_func(length)
+        if len(chunk) == length:
+            return chunk
+        received = bytearray()
+        while chunk:
+            received += chunk
+            if len(received) == length:
+                return bytes(received)
+            chunk = self._read_func(length - len(received))
+        raise EOFError
+
+
 class Decoder(object):
+    __slots__ = ('_stream', '_read', '_twoway', '_refs')
+
     def __init__(self, stream):
-        self._stream = stream
+        if isinstance(stream, BytesIO):
+            stream = _Cursor(stream.getvalue(), stream.tell())
+        elif stream is not None and not isinstance(stream, _Cursor):
+            stream = _StreamReader(stream)
+        self._set_stream(stream)
         self._twoway = False
         self._refs = []
 
+    def _set_stream(self, stream):
+        self._stream = stream
+        self._read = stream and stream.read
+
     def decode(self):
         header = self._read(2)
         if header[:2] != _DUBBO_MAGIC:
@@ -67,15 +156,21 @@ class Decoder(object):
             return header
         else:
             header += self._read(14)
-        flag = header[2]
-        proto = flag & _SERIALIZATION_MASK
-        logging.debug('decode with version "%d"' % proto)
+        _, _, _, _, body_length = _HEADER.unpack(header)
+        return self._decode_frame(header, self._read(body_length))
+
+    @classmethod
+    def decode_frame(cls, header, body):
+        ''' decode a message from its 16 bytes header and body, without touching any socket '''
+        return cls(None)._decode_frame(header, body)
+
+    def _decode_frame(self, header, body):
+        _, flag, status, invoke_id, _ = _HEADER.unpack(header)
+        logging.debug('decode with version "%d"', flag & _SERIALIZATION_MASK)
         if flag & _FLAG_TWOWAY:
             self._twoway = True
-        status = header[3]
-        invoke_id = bytes_to_long(header[4:12])
-        body_length = bytes_to_int(header[12:16])
-        self._stream = BytesIO(self._read(body_length))  # read all body into stream, to avoid over read issue
+        body = bytes(body)
+        self._set_stream(_Cursor(body))  # read all body into memory, to avoid over read issue
         try:
             if flag & _FLAG_REQUEST:
                 if flag & _FLAG_EVENT:
@@ -88,14 +183,12 @@ class Decoder(object):
                 # decode response
                 return self._decode_response_body(invoke_id, status)
         except Exception:
-            self._stream.seek(0)
-            logging.warn('Unable to decode message "%s"' % self._stream.read())
+            logging.warn('Unable to decode message "%s"' % body)
             raise
         finally:
-            left_bytes = self._stream.read()
+            left_bytes = body[self._stream.pos:]
             if left_bytes:
                 logging.warn('bytes "%s" undecoded!' % binascii.hexlify(left_bytes))
-            self._stream.close()
 
     def _decode_heartbeat_request(self, id_):
         data = self._read_object()
@@ -112,9 +205,8 @@ class Decoder(object):
         method_name = self._read_bytes()
         desc = self._read_bytes()
         arg_types = _desc_to_cls_names(desc.decode())
-        args = []
-        for _ in arg_types:
-            args.append(self._read_object())
+        read = self._read_object
+        args = [read() for _ in arg_types]
         # parse attachment
         attachment = self._read_object()
         # handle generic type request
@@ -136,243 +228,138 @@ class Decoder(object):
         return DubboResponse(id_, status, data, error)
 
     def _read_bytes(self):
-        tag = ord(self._read(1))
-        if tag == _BYTE_NONE:
-            return None
-        elif tag == _BYTE_TRUE:
-            return b'true'
-        elif tag == _BYTE_FALSE:
-            return b'false'
-        elif tag in _DIRECT_INTEGER:
-            return int_to_bytes(tag - 0x90)
-        elif tag in _BYTE_INT:
-            return int_to_bytes((tag - _BC_INT_BYTE_ZERO) << 8) + self._read(1)
-        elif tag in _SHORT_INT:
-            return int_to_bytes(tag - _BC_INT_SHORT_ZERO) + self._read(2)
-        elif tag in (b'I', _BC_LONG_INT):
-            return self._read(4)
-        elif tag in _DIRECT_LONG:
-            return int_to_bytes(tag - _BC_LONG_ZERO)
-        elif tag in _BYTE_LONG:
-            return int_to_bytes(tag - _BC_LONG_BYTE_ZERO) + self._read(1)
-        elif tag in _SHORT_LONG:
-            return int_to_bytes(tag - _BC_LONG_SHORT_ZERO) + self._read(2)
-        elif tag == _BYTE_L:
-            return self._read(8)
-        elif tag == _BC_DOUBLE_ZERO:
-            return b'0.0'
-        elif tag == _BC_DOUBLE_ONE:
-            return b'1.0'
-        elif tag == _BC_DOUBLE_BYTE:
-            return self._read(1)
-        elif tag == _BC_DOUBLE_SHORT:
-            return self._read(2)
-        elif tag == _BC_DOUBLE_MILL:
-            return double_to_bytes(0.001 * bytes_to_int(self._read(4)))
-        elif tag == _BYTE_D:
-            return self._read(8)
-        elif tag in (_BS_STRING, _BS_STRING_TRUNK):
-            _sbuf = b''
-            _chunk_len = bytes_to_int(self._read(2))
-            for _ in range(_chunk_len):
-                ch = self._read_char()
-                if ch >= b'\x00':
-                    _sbuf += ch
-            return _sbuf
-        elif tag in _ZERO_BYTE:
-            _sbuf = b''
-            _chunk_len = tag - 0x00
-            for _ in range(_chunk_len):
-                ch = self._read_char()
-                if ch >= b'\x00':
-                    _sbuf += ch
-            return _sbuf
-        elif tag in (0x30, 0x31, 0x32, 0x33):
-            _sbuf = b''
-            _chunk_len = (tag - 0x30) * 256 + ord(self._read(1))
-            for _ in range(_chunk_len):
-                ch = self._read_char()
-                if ch >= b'\x00':
-                    _sbuf += ch
-            return _sbuf
-        raise RuntimeError('read bytes "%d" error' % tag)
+        tag = self._stream.read_byte()
+        return _BYTES_READERS[tag](self, tag)
 
     def _read_object(self, tag=None):
         if tag is None:
-            tag = ord(self._read(1))
-        if tag == _BYTE_NONE:
-            return None
-        elif tag == _BYTE_TRUE:
-            return True
-        elif tag == _BYTE_FALSE:
-            return False
-        elif tag in _DIRECT_INTEGER:
-            return tag - 0x90
-        elif tag in _BYTE_INT:
-            return ((tag - _BC_INT_BYTE_ZERO) << 8) + ord(self._read(1))
-        elif tag in _SHORT_INT:
-            return ((tag - _BC_INT_SHORT_ZERO) << 16) + bytes_to_int(self._read(2))
-        elif tag in (b'I', _BC_LONG_INT):
-            return bytes_to_int(self._read(4))
-        elif tag in _DIRECT_LONG:
-            return tag - _BC_LONG_ZERO
-        elif tag in _BYTE_LONG:
-            return (tag - _BC_LONG_BYTE_ZERO) * 256 + ord(self._read(1))
-        elif tag in _SHORT_LONG:
-            return ((tag - _BC_LONG_SHORT_ZERO) << 16) + bytes_to_int(self._read(2))
-        elif tag == _BYTE_L:
-            return bytes_to_long(self._read(8))
-        elif tag == _BC_DOUBLE_ZERO:
-            return 0.0
-        elif tag == _BC_DOUBLE_ONE:
-            return 1.0
-        elif tag == _BC_DOUBLE_BYTE:
-            return bytes_to_int(self._read(1), signed=True)
-        elif tag == _BC_DOUBLE_SHORT:
-            return bytes_to_int(self._read(2), signed=True)
-        elif tag == _BC_DOUBLE_MILL:
-            return 0.001 * bytes_to_int(self._read(4), signed=True)
-        elif tag == _BYTE_D:
-            return bytes_to_double(self._read(8))
-        elif tag == _BYTE_DATE:
-            return timestamp_to_datetime(bytes_to_long(self._read(8)))
-        elif tag == _BYTE_DATE_MINUTE:
-            return timestamp_to_datetime(bytes_to_int(self._read(4)) * 60)
-        elif tag in (_BS_STRING, _BS_STRING_TRUNK):
-            _sbuf = b''
-            _chunk_len = bytes_to_int(self._read(2))
-            for _ in range(_chunk_len):
-                ch = self._read_char()
-                if ch >= b'\x00':
-                    _sbuf += ch
-            return _sbuf.decode()
-        elif tag in _ZERO_BYTE:
-            _sbuf = b''
-            _chunk_len = tag - 0x00
-            for _ in range(_chunk_len):
-                ch = self._read_char()
-                if ch >= b'\x00':
-                    _sbuf += ch
-            return _sbuf.decode()
-        elif tag in (0x30, 0x31, 0x32, 0x33):
-            _sbuf = b''
-            _chunk_len = (tag - 0x30) * 256 + ord(self._read(1))
-            for _ in range(_chunk_len):
-                ch = self._read_char()
-                if ch >= b'\x00':
-                    _sbuf += ch
-            return _sbuf.decode()
-        elif tag in (ord('A'), ord('B')):
-            _sbuf = b''
-            _chunk_len = bytes_to_int(self._read(2))
+            tag = self._stream.read_byte()
+        return _OBJECT_READERS[tag](self, tag)
+
+    # tag readers, dispatched through the 256 entries tables built below the class
+
+    def _tag_byte_int(self, tag):
+        return ((tag - _BC_INT_BYTE_ZERO) << 8) + self._stream.read_byte()
+
+    def _tag_short_int(self, tag):
+        return ((tag - _BC_INT_SHORT_ZERO) << 16) + self._stream.unpack(UINT16)
+
+    def _tag_int(self, tag):
+        return self._stream.unpack(INT32)
+
+    def _tag_byte_long(self, tag):
+        return ((tag - _BC_LONG_BYTE_ZERO) << 8) + self._stream.read_byte()
+
+    def _tag_short_long(self, tag):
+        return ((tag - _BC_LONG_SHORT_ZERO) << 16) + self._stream.unpack(UINT16)
+
+    def _tag_long(self, tag):
+        return self._stream.unpack(INT64)
+
+    def _tag_double_byte(self, tag):
+        return self._stream.unpack(INT8)
+
+    def _tag_double_short(self, tag):
+        return self._stream.unpack(INT16)
+
+    def _tag_double_mill(self, tag):
+        return 0.001 * self._stream.unpack(INT32)
+
+    def _tag_double(self, tag):
+        return self._stream.unpack(DOUBLE)
+
+    def _tag_date(self, tag):
+        return timestamp_to_datetime(self._stream.unpack(UINT64))
+
+    def _tag_date_minute(self, tag):
+        return timestamp_to_datetime(self._stream.unpack(UINT32) * 60)
+
+    def _tag_string(self, tag):
+        if tag <= 0x1f:
+            _chunk_len = tag
+        elif tag <= 0x33:
+            _chunk_len = (tag - 0x30) * 256 + self._stream.read_byte()
+        else:  # b'S' or b'R'
+            _chunk_len = self._stream.unpack(UINT16)
+        return self._read_chars(_chunk_len)
+
+    def _tag_binary(self, tag):
+        _sbuf = bytearray()
+        _chunk_len = self._stream.unpack(UINT16)
+        _chunk_len, data = self._read_byte(_chunk_len)
+        while data >= 0:
+            _sbuf += data
             _chunk_len, data = self._read_byte(_chunk_len)
-            while data >= 0:
-                _sbuf += data
-                _chunk_len, data = self._read_byte(_chunk_len)
-            return _sbuf
-        elif tag in range(0x20, 0x2f + 1):
-            return self._read(tag - 0x20)
-        elif tag in (0x34, 0x35, 0x36, 0x37):
-            return self._read((tag - 0x34) * 256 + ord(self._read(1)))
-        elif tag == 0x55:  # variable length list typed
-            raise RuntimeError('unimplemented')
-        elif tag == 0x57:  # list variable untyped
-            raise RuntimeError('unimplemented')
-        elif tag == 0x56:  # fixed list typed
-            self._read_bytes()  # list type
-            length = self._read_int()
-            return self._read_list(length, JavaList)
-        elif tag == 0x58:  # fixed list untyped
+        return bytes(_sbuf)
+
+    def _tag_short_binary(self, tag):
+        return self._read((tag - 0x34) * 256 + self._stream.read_byte())
+
+    def _tag_typed_list(self, tag):
+        self._read_bytes()  # list type
+        if tag == 0x56:  # fixed list typed
             length = self._read_int()
-            return self._read_list(length)
-        elif tag in range(0x70, 0x78):  # compact fixed list
-            self._read_bytes()  # list type
+        else:  # compact fixed list
             length = tag - 0x70
-            return self._read_list(length, JavaList)
-        elif tag in range(0x78, 0x7f + 1):  # compact fixed list untyped
+        return self._read_list(length, JavaList)
+
+    def _tag_untyped_list(self, tag):
+        if tag == 0x58:  # fixed list untyped
+            length = self._read_int()
+        else:  # compact fixed list untyped
             length = tag - 0x78
-            return self._read_list(length)
-        elif tag == ord(b'H'):
-            return self._read_map()
-        elif tag == ord(b'M'):
-            return self._read_map(tag)
-        elif tag == ord(b'C'):
-            self._read_object_def()
-            return self._read_object()
-        elif tag in range(0x60, 0x6f + 1):
-            idx = tag - 0x60
-            try:
-                ref = self._refs[idx]
-                ref['args'] = []
-                for field_name in ref['fields']:
-                    ref['args'].append(self._read_object())
-                return _cls_factory(ref)
-            except IndexError:
-                raise RuntimeError('class definition not found, idx: %d' % idx)
-        elif tag == ord(b'0'):
-            raise RuntimeError('unimplemented')
-        elif tag == _BC_REF:
-            idx = self._read_int()
-            return self._refs[idx]
-        elif tag == 0x5a:  # b'Z'
-            raise EOFError
-        else:
-            raise RuntimeError('unknown code "%s"' % tag)
+        return self._read_list(length)
+
+    def _tag_class_def(self, tag):
+        self._read_object_def()
+        return self._read_object()
+
+    def _tag_instance(self, tag):
+        idx = tag - 0x60
+        try:
+            cls = self._refs[idx]
+        except IndexError:
+            raise RuntimeError('class definition not found, idx: %d' % idx)
+        read = self._read_object
+        return cls(*[read() for _ in cls._fields])
+
+    def _tag_ref(self, tag):
+        return self._refs[self._read_int()]
+
+    def _tag_end(self, tag):
+        raise EOFError
+
+    def _tag_unimplemented(self, tag):
+        raise RuntimeError('unimplemented')
+
+    def _tag_unknown_object(self, tag):
+        raise RuntimeError('unknown code "%s"' % tag)
+
+    def _tag_unknown_bytes(self, tag):
+        raise RuntimeError('read bytes "%d" error' % tag)
+
+    def _tag_unknown_int(self, tag):
+        raise RuntimeError('read int error "%d"' % tag)
 
     def _read_list(self, length, list_type=None):
+        read = self._read_object
         if list_type:
-            return list_type([self._read_object() for _ in range(length)])
-        return [self._read_object() for _ in range(length)]
+            return list_type([read() for _ in range(length)])
+        return [read() for _ in range(length)]
 
     def _read_object_def(self):
         type_ = self._read_bytes()
         len_ = self._read_int()
-        field_names = []
-        for _ in range(len_):
-            field_names.append(self._read_bytes())
-        self._refs.append({'type': type_, 'fields': field_names})
+        field_names = tuple(self._read_bytes() for _ in range(len_))
+        self._refs.append(_get_class(type_, field_names))
 
     def _read_int(self):
-        tag = ord(self._read(1))
-        if tag == ord(b'N'):
-            return 0
-        elif tag == ord(b'F'):
-            return 0
-        elif tag == ord(b'T'):
-            return 1
-        elif tag in range(0x80, 0xbf + 1):
-            return tag - _BC_INT_ZERO
-        elif tag in range(0xc0, 0xcf + 1):
-            return ((tag - _BC_INT_BYTE_ZERO) << 8) + ord(self._read(1))
-        elif tag in range(0xd0, 0xd7 + 1):
-            return ((tag - _BC_INT_SHORT_ZERO) << 16) + bytes_to_int(self._read(2))
-        elif tag in (ord(b'I'), _BC_LONG_INT):
-            return bytes_to_int(self._read(4))
-        elif tag in range(0xd8, 0xef + 1):
-            return tag - _BC_LONG_ZERO
-        elif tag in range(0xf0, 0xff + 1):
-            return ((tag - _BC_LONG_BYTE_ZERO) << 8) + ord(self._read(1))
-        elif tag in range(0x38, 0x3f + 1):
-            return ((tag - _BC_LONG_SHORT_ZERO) << 16) + bytes_to_int(self._read(2))
-        elif tag == ord(b'L'):
-            return bytes_to_long(self._read(8))
-        elif tag == _BC_DOUBLE_ZERO:
-            return 0
-        elif tag == _BC_DOUBLE_ONE:
-            return 1
-        elif tag == _BC_DOUBLE_BYTE:
-            return bytes_to_int(self._read(1), signed=True)
-        elif tag == _BC_DOUBLE_SHORT:
-            return bytes_to_int(self._read(2), signed=True)
-        elif tag == _BC_DOUBLE_MILL:
-            return int(0.001 * bytes_to_int(self._read(4), signed=True))
-        elif tag == ord(b'D'):
-            return bytes_to_long(self._read(8))
-        raise RuntimeError('read int error "%d"' % tag)
+        tag = self._stream.read_byte()
+        return _INT_READERS[tag](self, tag)
 
     def _read_map(self, code=None):
         if code == b't':
-            type_len = struct.unpack('>H', self._read(2))[0]
+            type_len = UINT16.unpack(self._read(2))[0]
             if type_len > 0:
                 # a typed map deserializes to an object
                 type_ = self._read(type_len)
@@ -412,101 +399,193 @@ class Decoder(object):
 
         return key, value
 
-    def _read_char(self):
-        ch = self._read(1)
-        int_ch = ord(ch)
-        if int_ch < 0x80:
-            return ch
-        elif (int_ch & 0xe0) == 0xc0:
-            return ch + self._read(1)
-        elif ((int_ch & 0xf0) == 0xe0):
-            return ch + self._read(2)
-
-        raise RuntimeError('unknown charactor "%d"' % ch)
+    def _read_chars(self, count):
+        ''' read the utf-8 bytes of count characters, walking lead bytes and reading once '''
+        buf = self._stream.buf
+        start = pos = self._stream.pos
+        try:
+            for _ in range(count):
+                pos += _UTF8_LENGTHS[buf[pos]]
+        except IndexError:
+            raise EOFError
+        return self._read(pos - start)
 
     def _read_byte(self, _chunk_len):
         while _chunk_len <= 0:
-            code = ord(self._read(1))
+            code = self._stream.read_byte()
             if code in (ord(b'A'), ord(b'B')):
-                _chunk_len = bytes_to_int(self._read(2))
+                _chunk_len = self._stream.unpack(UINT16)
             elif code in range(0x20, 0x2f + 1):
                 _chunk_len = code - 0xa0
             elif code in (0x34, 0x35, 0x36, 0x37):
-                _chunk_len = (code - 0x34) * 256 + ord(self._read(1))
+                _chunk_len = (code - 0x34) * 256 + self._stream.read_byte()
 
         _chunk_len -= 1
         return _chunk_len, self._read(1)
 
-    def _read(self, length):
-        read_func = hasattr(self._stream, 'recv') and self._stream.recv or self._stream.read
-        received = b''
-        while len(received) < length:
-            chunk = read_func(length)
-            if not chunk:
-                raise EOFError
-            received += chunk
-        return received
-
     def _read_until_prompt(self):
-        received = b''
+        # byte by byte, a socket may already hold the next message behind the prompt
+        received = bytearray()
         while not received.endswith(_DUBBO_END):
-            chunk = self._read(1)
-            if not chunk:
-                raise EOFError
-            received += chunk
-        return received
+            received += self._read(1)
+        return bytes(received)
+
+
+def _tag_table(default, entries):
+    ''' build a 256 entries list mapping each tag byte to its reader '''
+    table = [default] * 256
+    for tags, reader in entries:
+        for tag in tags:
+            table[tag] = reader
+    return table
+
+
+_STRING_TAGS = (_BS_STRING, _BS_STRING_TRUNK) + tuple(_ZERO_BYTE) + (0x30, 0x31, 0x32, 0x33)
+
+_NUMBER_READERS = (
+    (_DIRECT_INTEGER, lambda self, tag: tag - _BC_INT_ZERO),
+    (_BYTE_INT, Decoder._tag_byte_int),
+    (_SHORT_INT, Decoder._tag_short_int),
+    ((ord(b'I'), _BC_LONG_INT), Decoder._tag_int),
+    (_DIRECT_LONG, lambda self, tag: tag - _BC_LONG_ZERO),
+    (_BYTE_LONG, Decoder._tag_byte_long),
+    (_SHORT_LONG, Decoder._tag_short_long),
+    ((_BYTE_L,), Decoder._tag_long),
+    ((_BC_DOUBLE_BYTE,), Decoder._tag_double_byte),
+    ((_BC_DOUBLE_SHORT,), Decoder._tag_double_short),
+)
+
+_OBJECT_READERS = _tag_table(Decoder._tag_unknown_object, _NUMBER_READERS + (
+    ((_BYTE_NONE,), lambda self, tag: None),
+    ((_BYTE_TRUE,), lambda self, tag: True),
+    ((_BYTE_FALSE,), lambda self, tag: False),
+    ((_BC_DOUBLE_ZERO,), lambda self, tag: 0.0),
+    ((_BC_DOUBLE_ONE,), lambda self, tag: 1.0),
+    ((_BC_DOUBLE_MILL,), Decoder._tag_double_mill),
+    ((_BYTE_D,), Decoder._tag_double),
+    ((_BYTE_DATE,), Decoder._tag_date),
+    ((_BYTE_DATE_MINUTE,), Decoder._tag_date_minute),
+    (_STRING_TAGS, lambda self, tag: self._tag_string(tag).decode()),
+    ((ord(b'A'), ord(b'B')), Decoder._tag_binary),
+    (range(0x20, 0x2f + 1), lambda self, tag: self._read(tag - 0x20)),
+    ((0x34, 0x35, 0x36, 0x37), Decoder._tag_short_binary),
+    ((0x55, 0x57), Decoder._tag_unimplemented),  # variable length list
+    ((0x56,) + tuple(range(0x70, 0x78)), Decoder._tag_typed_list),
+    ((0x58,) + tuple(range(0x78, 0x7f + 1)), Decoder._tag_untyped_list),
+    ((ord(b'H'),), lambda self, tag: self._read_map()),
+    ((ord(b'M'),), lambda self, tag: self._read_map(tag)),
+    ((ord(b'C'),), Decoder._tag_class_def),
+    (range(0x60, 0x6f + 1), Decoder._tag_instance),
+    ((_BC_REF,), Decoder._tag_ref),
+    ((0x5a,), Decoder._tag_end),  # b'Z'
+))
+
+_BYTES_READERS = _tag_table(Decoder._tag_unknown_bytes, (
+    ((_BYTE_NONE,), lambda self, tag: None),
+    ((_BYTE_TRUE,), lambda self, tag: b'true'),
+    ((_BYTE_FALSE,), lambda self, tag: b'false'),
+    (_DIRECT_INTEGER, lambda self, tag: int_to_bytes(tag - _BC_INT_ZERO)),
+    (_BYTE_INT, lambda self, tag: int_to_bytes((tag - _BC_INT_BYTE_ZERO) << 8) + self._read(1)),
+    (_SHORT_INT, lambda self, tag: int_to_bytes(tag - _BC_INT_SHORT_ZERO) + self._read(2)),
+    ((ord(b'I'), _BC_LONG_INT), lambda self, tag: self._read(4)),
+    (_DIRECT_LONG, lambda self, tag: int_to_bytes(tag - _BC_LONG_ZERO)),
+    (_BYTE_LONG, lambda self, tag: int_to_bytes(tag - _BC_LONG_BYTE_ZERO) + self._read(1)),
+    (_SHORT_LONG, lambda self, tag: int_to_bytes(tag - _BC_LONG_SHORT_ZERO) + self._read(2)),
+    ((_BYTE_L, _BYTE_D), lambda self, tag: self._read(8)),
+    ((_BC_DOUBLE_ZERO,), lambda self, tag: b'0.0'),
+    ((_BC_DOUBLE_ONE,), lambda self, tag: b'1.0'),
+    ((_BC_DOUBLE_BYTE,), lambda self, tag: self._read(1)),
+    ((_BC_DOUBLE_SHORT,), lambda self, tag: self._read(2)),
+    ((_BC_DOUBLE_MILL,), lambda self, tag: double_to_bytes(0.001 * self._stream.unpack(INT32))),
+    (_STRING_TAGS, Decoder._tag_string),
+))
+
+_INT_READERS = _tag_table(Decoder._tag_unknown_int, _NUMBER_READERS + (
+    ((_BYTE_NONE, _BYTE_FALSE, _BC_DOUBLE_ZERO), lambda self, tag: 0),
+    ((_BYTE_TRUE, _BC_DOUBLE_ONE), lambda self, tag: 1),
+    ((_BC_DOUBLE_MILL,), lambda self, tag: int(Decoder._tag_double_mill(self, tag))),
+    ((_BYTE_D,), Decoder._tag_long),
+))
+
+
+_PRIMITIVE_CLS_NAMES = {
+    'V': 'None',
+    'Z': 'bool',
+    'B': 'bytes',
+    'C': 'chr',
+    'D': 'float',
+    'F': 'float',
+    'I': 'int',
+    'J': 'int',
+    'S': 'int',
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _desc_to_cls_names(desc):
+    ''' convert a method descriptor to a tuple of class names '''
+    cls_names = []
+    idx, length = 0, len(desc)
+
+    while idx < length:
+        start = idx
+        while idx < length and desc[idx] == '[':
+            idx += 1
+        ch = desc[idx:idx + 1]
+        if ch == 'L':
+            idx = desc.find(';', idx) + 1
+            if idx == 0:
+                raise RuntimeError('unknown type "%s"' % desc[start:])
+        elif ch and ch in _PRIMITIVE_CLS_NAMES:
+            idx += 1
+        else:
+            raise RuntimeError('unknown type "%s"' % ch)
 
+        if desc[start] == '[':  # TODO: array type handling
+            cls_names.append(desc[start:idx].replace('/', '.'))
+        elif ch == 'L':
+            cls_names.append(desc[start + 1:idx - 1].replace('/', '.'))
+        else:
+            cls_names.append(_PRIMITIVE_CLS_NAMES[ch])
 
-_DESC_PTN = re.compile(r'(?:[VZBCDFIJS])|(?:L[_$a-zA-Z][_$a-zA-Z0-9/]*;)|(?:\[+(?:[VZBCDFIJS]|L[_$a-zA-Z][_$a-zA-Z0-9/]*;))')
+    return tuple(cls_names)
 
 
-def _desc_to_cls_names(desc):
-    _handler_map = {
-        'V': lambda e: 'None',
-        'Z': lambda e: 'bool',
-        'B': lambda e: 'bytes',
-        'C': lambda e: 'chr',
-        'D': lambda e: 'float',
-        'F': lambda e: 'float',
-        'I': lambda e: 'int',
-        'J': lambda e: 'int',
-        'S': lambda e: 'int',
-        'L': lambda e: e[1:-1].replace('/', '.'),
-        '[': lambda e: e.replace('/', '.')}  # TODO: array type handling
-    cls_names = []
+_CLS_NAME_DESCS = {
+    'int': 'I',
+    'long': 'J',
+    'NoneType': 'V',
+    'bool': 'Z',
+    'bytes': 'B',
+    'str': 'S',
+    'float': 'D',
+}
 
-    for cls_desc in _DESC_PTN.findall(desc):
-        _first_byte = cls_desc[0]
-        if _first_byte not in _handler_map:
-            raise RuntimeError('unknown type "%s"' % _first_byte)
-        cls_names.append(_handler_map[_first_byte](cls_desc))
 
-    return cls_names
+def _complex_desc(type_name):
+    if type_name[0] == '[':  # TODO: array handling
+        return type_name.replace('.', '/')
+    return 'L' + type_name.replace('.', '/') + ';'
 
 
+@functools.lru_cache(maxsize=1024)
 def _cls_names_to_desc(cls_names):
-    _handler_map = {
-        'int': 'I',
-        'long': 'J',
-        'NoneType': 'V',
-        'bool': 'Z',
-        'bytes': 'B',
-        'str': 'S',
-        'float': 'D',
-    }
+    ''' convert a tuple of python type names to a method descriptor '''
+    return ''.join(_CLS_NAME_DESCS.get(name) or _complex_desc(name) for name in cls_names)
 
-    def complex_handler(type_name):
-        if type_name[0] == '[':  # TODO: array handling
-            return type_name.replace('.', '/')
-        return 'L' + type_name.replace('.', '/') + ';'
 
-    return ''.join(_handler_map.get(name, complex_handler(name)) for name in cls_names)
+@functools.lru_cache(maxsize=512)
+def _get_class(type_, field_names):
+    ''' get class of a hessian class definition, cached across messages and connections '''
+    return _get_object_class(type_.decode(), tuple(f.decode() for f in field_names))
 
 
-def _cls_factory(ref):
-    type_name = ref['type'].decode()
-    kwargs = dict(zip(map(lambda f: f.decode(), ref['fields']), ref['args']))
-    return new_object(type_name, **kwargs)
+@functools.lru_cache(maxsize=512)
+def _get_object_class(cls_name, field_names):
+    ''' get the namedtuple class of a java class name and its field names '''
+    cls = namedtuple(cls_name.replace('.', '__DOT__'), field_names)
+    cls.__name__ = cls_name
+    return cls
 
 
 _STRING_DIRECT_MAX = 0x1f
@@ -514,102 +593,178 @@ _STRING_SHORT_MAX = 0x3ff
 _BC_STRING_SHORT = 0x30
 
 
-def encode_object(field, idx=0, cls_names=[]):
+def encode_object(field, idx=0, cls_names=None):
     ''' encode an object into hessian2 stream '''
-    if field is None:
-        return b'N'
-    elif field is True:
-        return b'T'
-    elif field is False:
-        return b'F'
+    out = bytearray()
+    _encode_object(field, out, idx, cls_names)
+    return bytes(out)
+
+
+def _encode_object(field, out, idx=0, cls_names=None):
+    ''' append hessian2 stream of an object to bytearray out '''
+    encoder = _TYPE_ENCODERS.get(type(field))  # common exact types first, subclasses fall through
+    if encoder is not None:
+        encoder(field, out)
     elif isinstance(field, str):
-        # TODO: field convert required? see Hessian2Output.java -> printString
-        length = len(field)
-        if length <= _STRING_DIRECT_MAX:
-            return int_to_bytes(length) + field.encode()
-        elif length <= _STRING_SHORT_MAX:
-            return int_to_bytes((_BC_STRING_SHORT << 8) + length) + field.encode()
-        return b'S' + int_to_bytes(length) + field.encode()
+        _encode_str(field, out)
     elif isinstance(field, dict):
-        result = b'H'
-        for k, v in field.items():
-            result += encode_object(k, cls_names=[])
-            result += encode_object(v, cls_names=[])
-        result += b'Z'
-        return result
+        _encode_map(field, out)
     elif isinstance(field, (list, set)):
-        result = b''
-        type_ = type(field).__name__
-        if len(field) < 8:
-            if type_ not in ('list', 'set'):
-                result += int_to_bytes(len(field) + 0x70)
-                result += encode_object(type_)
-            else:
-                result += int_to_bytes(len(field) + 0x78)
-        else:
-            if type_ not in ('list', 'set'):
-                result += b'\x56'
-                result += encode_object(type_)
-            else:
-                result += b'\x58'
-            result += encode_object(len(field))
-        result += b''.join(encode_object(e, cls_names=[]) for e in field)
-        return result
+        _encode_list(field, out)
     elif isinstance(field, long):
-        if -0x08 <= field and field <= 0x0f:
-            return int_to_bytes(field + _BC_LONG_ZERO)
-        elif -0x800 <= field and field <= 0x7ff:
-            return int_to_bytes((_BC_LONG_BYTE_ZERO << 8) + field)
-        elif -0x40000 <= field and field <= 0x3ffff:
-            return int_to_bytes((_BC_LONG_SHORT_ZERO << 16) + field)
-        elif -0x80000000 <= field and field <= 0x7fffffff:
-            return chr(_BC_LONG_INT).encode() + int_to_bytes(field, 4)
-        return b'L' + long_to_bytes(field)
+        _encode_long(field, out)
     elif isinstance(field, int):
-        if field >= -0x10 and field <= 0x2f:
-            return int_to_bytes(field + _BC_INT_ZERO)
-        elif field >= -0x800 and field <= 0x7ff:
-            return int_to_bytes((_BC_INT_BYTE_ZERO << 8) + field)
-        elif field >= -0x40000 and field <= 0x3ffff:
-            return int_to_bytes((_BC_INT_SHORT_ZERO << 16) + field)
-        return b'I' + int_to_bytes(field, 4)
+        _encode_int(field, out)
     elif isinstance(field, (float, double)):
-        int_field = int(field)
-        if int_field == field:
-            if field == 0:
-                return chr(_BC_DOUBLE_ZERO).encode()
-            elif field == 1:
-                return chr(_BC_DOUBLE_ONE).encode()
-            elif field in range(-128, 128):
-                return chr(_BC_DOUBLE_BYTE).encode() + int_to_bytes(int_field, signed=True)
-            elif field in range(-32768, 32768):
-                return chr(_BC_DOUBLE_SHORT).encode() + int_to_bytes(int_field, signed=True)
-
-        mills = int(field * 1000)
-        if mills * 0.001 == field:
-            return chr(_BC_DOUBLE_MILL).encode() + int_to_bytes(mills, 4, signed=True)
-        return b'D' + double_to_bytes(field)
+        _encode_double(field, out)
     elif hasattr(field, '_fields'):  # namedtuple subclass instance
-        cls_name = field.__class__.__name__
-        if cls_name not in cls_names:  # XXX: not thread safe
-            cls_names.append(cls_name)
-        # object def
-        result = b'C' + encode_object(cls_name)
-        #   count of field names
-        result += encode_object(len(field._fields))
-        #   field names
-        for field_name in field._fields:
-            result += encode_object(field_name)
-        # object fields
-        result += int_to_bytes(idx + cls_names.index(cls_name) + 0x60)
-        for field_name in field._fields:
-            result += encode_object(getattr(field, field_name), idx, cls_names)
-        return result
+        _encode_instance(field, out, idx, {} if cls_names is None else cls_names)
     else:  # custom object
         raise RuntimeError('unknown field "%s", type "%s"' % (field, type(field)))
 
 
+_CONSTANT_BYTES = {None: b'N', True: b'T', False: b'F'}
+
+
+def _encode_constant(field, out):
+    out += _CONSTANT_BYTES[field]
+
+
+def _encode_map(field, out):
+    out += b'H'
+    for k, v in field.items():
+        _encode_object(k, out)
+        _encode_object(v, out)
+    out += b'Z'
+
+
+def _encode_str(field, out):
+    # TODO: field convert required? see Hessian2Output.java -> printString
+    length = len(field)
+    if length <= _STRING_DIRECT_MAX:
+        out += UINT8.pack(length)
+    elif length <= _STRING_SHORT_MAX:
+        out += UINT16.pack((_BC_STRING_SHORT << 8) + length)
+    else:
+        out += b'S'
+        out += UINT16.pack(length)
+    out += field.encode()
+
+
+def _encode_list(field, out):
+    type_ = type(field).__name__
+    typed = type_ not in ('list', 'set')
+    if len(field) < 8:
+        if typed:
+            out += UINT8.pack(len(field) + 0x70)
+            _encode_str(type_, out)
+        else:
+            out += UINT8.pack(len(field) + 0x78)
+    else:
+        if typed:
+            out += b'\x56'
+            _encode_str(type_, out)
+        else:
+            out += b'\x58'
+        _encode_int(len(field), out)
+    for e in field:
+        _encode_object(e, out)
+
+
+def _encode_long(field, out):
+    if -0x08 <= field and field <= 0x0f:
+        out += UINT8.pack(field + _BC_LONG_ZERO)
+    elif -0x800 <= field and field <= 0x7ff:
+        out += UINT16.pack((_BC_LONG_BYTE_ZERO << 8) + field)
+    elif -0x40000 <= field and field <= 0x3ffff:
+        out += UINT32.pack((_BC_LONG_SHORT_ZERO << 16) + field)[1:]
+    elif -0x80000000 <= field and field <= 0x7fffffff:
+        out += _B_LONG_INT
+        out += INT32.pack(field)
+    else:
+        out += b'L'
+        out += INT64.pack(field)
+
+
+def _encode_int(field, out):
+    if field >= -0x10 and field <= 0x2f:
+        out += UINT8.pack(field + _BC_INT_ZERO)
+    elif field >= -0x800 and field <= 0x7ff:
+        out += UINT16.pack((_BC_INT_BYTE_ZERO << 8) + field)
+    elif field >= -0x40000 and field <= 0x3ffff:
+        out += UINT32.pack((_BC_INT_SHORT_ZERO << 16) + field)[1:]
+    else:
+        out += b'I'
+        out += INT32.pack(field)
+
+
+def _encode_double(field, out):
+    int_field = int(field)
+    if int_field == field and -32768 <= int_field < 32768:
+        if field == 0:
+            out += _B_DOUBLE_ZERO
+        elif field == 1:
+            out += _B_DOUBLE_ONE
+        elif -128 <= int_field < 128:
+            out += _B_DOUBLE_BYTE
+            out += INT8.pack(int_field)
+        else:
+            out += _B_DOUBLE_SHORT
+            out += INT16.pack(int_field)
+        return
+
+    mills = int(field * 1000)
+    if mills * 0.001 == field:
+        out += _B_DOUBLE_MILL
+        out += INT32.pack(mills)
+    else:
+        out += b'D'
+        out += DOUBLE.pack(field)
+
+
+def _encode_instance(field, out, idx, cls_names):
+    cls_name = field.__class__.__name__
+    cls_idx = cls_names.setdefault(cls_name, len(cls_names))  # {cls_name: index}
+    # object def
+    out += b'C'
+    _encode_str(cls_name, out)
+    #   count of field names
+    _encode_int(len(field._fields), out)
+    #   field names
+    for field_name in field._fields:
+        _encode_str(field_name, out)
+    # object fields
+    out += UINT8.pack(idx + cls_idx + 0x60)
+    for field_name in field._fields:
+        _encode_object(getattr(field, field_name), out, idx, cls_names)
+
+
+_TYPE_ENCODERS = {
+    str: _encode_str,
+    int: _encode_int,
+    long: _encode_long,
+    type(None): _encode_constant,
+    bool: _encode_constant,
+    dict: _encode_map,
+    list: _encode_list,
+    float: _encode_double,
+    double: _encode_double,
+    set: _encode_list,
+}
+
+
+_HEADER = struct.Struct('>2sBBQI')  # magic, flag, status, id, body length
+_HEADER_LENGTH = _HEADER.size
+_HEADER_PLACEHOLDER = bytes(_HEADER_LENGTH)  # reserve header space, packed once body length is known
+_REQUEST_FLAGS = {  # {twoway: flag}
+    False: _FLAG_REQUEST | _HESSIAN2_SERIALIZATION_ID,
+    True: _FLAG_REQUEST | _FLAG_TWOWAY | _HESSIAN2_SERIALIZATION_ID,
+}
+
+
 class DubboRequest(object):
+    __slots__ = ('id', 'twoway', 'dubbo_version', 'service_name', 'service_version', 'method_name', 'args', 'attachment')
+
     def __init__(self, id, twoway, dubbo_version, service_name, method_name, args, service_version='1.0', attachment={}):
         self.id = id
         self.twoway = twoway
@@ -621,53 +776,35 @@ class DubboRequest(object):
         self.attachment = attachment
 
     def encode(self):
-        stream = BytesIO()
-        self._encode_header(stream)  # 12byte header
-        self._encode_body(stream)  # 4byte body length + body
-        stream.seek(0)
-        try:
-            return stream.read()
-        finally:
-            stream.close()
-
-    def _encode_header(self, stream):
-        stream.write(_DUBBO_MAGIC)
-        flag = _FLAG_REQUEST | _HESSIAN2_SERIALIZATION_ID
-        if self.twoway:
-            flag |= _FLAG_TWOWAY
-        stream.write(int_to_bytes(flag))  # flag
-        stream.write(b'\x00')  # status
-        stream.write(long_to_bytes(self.id))
-
-    def _encode_body(self, stream):
-        body = self._get_body()
-        stream.write(int_to_bytes(len(body), 4))
-        stream.write(body)
-
-    def _get_body(self):
-        return encode_object(self.dubbo_version) + \
-            encode_object(self.service_name) + \
-            encode_object(self.service_version) + \
-            encode_object(self.method_name) + \
-            self._get_desc() + \
-            self._get_args() + \
-            self._get_attachment()
-
-    def _get_desc(self):
-        return encode_object(_cls_names_to_desc([type(arg).__name__ for arg in self.args]))
-
-    def _get_args(self):
-        cls_names = []
-        return b''.join([encode_object(arg, idx, cls_names) for idx, arg in enumerate(self.args)])
-
-    def _get_attachment(self):
-        return encode_object(self.attachment)
+        buf = bytearray()
+        self.encode_into(buf)
+        return bytes(buf)
+
+    def encode_into(self, buf):
+        ''' encode message into bytearray buf, replacing its content '''
+        del buf[:]
+        buf += _HEADER_PLACEHOLDER
+        self._encode_body(buf)
+        _HEADER.pack_into(buf, 0, _DUBBO_MAGIC, _REQUEST_FLAGS[bool(self.twoway)], 0, self.id, len(buf) - _HEADER_LENGTH)
+
+    def _encode_body(self, out):
+        _encode_object(self.dubbo_version, out)
+        _encode_object(self.service_name, out)
+        _encode_object(self.service_version, out)
+        _encode_object(self.method_name, out)
+        _encode_object(_cls_names_to_desc(tuple(type(arg).__name__ for arg in self.args)), out)
+        cls_names = {}
+        for idx, arg in enumerate(self.args):
+            _encode_object(arg, out, idx, cls_names)
+        _encode_object(self.attachment, out)
 
     def __repr__(self):
         return f'dubbo_version: {self.dubbo_version}, method: {self.service_name}.{self.method_name}:{self.service_version}, args: {self.args}, attachment: {self.attachment}'
 
 
 class _HeartBeat(object):
+    __slots__ = ('id', 'data', '_twoway')
+
     def __init__(self, id, data=None, twoway=False):
         self.id = id
         self.data = data
@@ -677,37 +814,30 @@ class _HeartBeat(object):
         return self._twoway
 
     def encode(self):
-        stream = BytesIO()
-        self._encode_header(stream)  # 12byte header
-        self._encode_body(stream)  # 4byte body length + body
-        stream.seek(0)
-        try:
-            return stream.read()
-        finally:
-            stream.close()
+        buf = bytearray()
+        self.encode_into(buf)
+        return bytes(buf)
 
-    def _encode_header(self, stream):
-        stream.write(_DUBBO_MAGIC)
-        stream.write(int_to_bytes(self._get_flag()))  # flag
-        stream.write(b'\x00')  # status
-        stream.write(long_to_bytes(self.id))
+    def encode_into(self, buf):
+        ''' encode message into bytearray buf, replacing its content '''
+        del buf[:]
+        buf += _HEADER_PLACEHOLDER
+        self._encode_body(buf)
+        _HEADER.pack_into(buf, 0, _DUBBO_MAGIC, self._get_flag(), 0, self.id, len(buf) - _HEADER_LENGTH)
 
     def _get_flag(self):
         raise RuntimeError('not implemented')
 
-    def _encode_body(self, stream):
-        body = self._get_body()
-        stream.write(int_to_bytes(len(body), 4))
-        stream.write(body)
-
-    def _get_body(self):
-        return encode_object(self.data)
+    def _encode_body(self, out):
+        _encode_object(self.data, out)
 
     def __repr__(self):
         return f'id: {self.id}, twoway: {self._twoway}'
 
 
 class DubboHeartBeatRequest(_HeartBeat):
+    __slots__ = ()
+
     def _get_flag(self):
         flag = _FLAG_REQUEST | _FLAG_EVENT | _HESSIAN2_SERIALIZATION_ID
         if self.is_twoway():
@@ -716,6 +846,8 @@ class DubboHeartBeatRequest(_HeartBeat):
 
 
 class DubboHeartBeatResponse(_HeartBeat):
+    __slots__ = ()
+
     def _get_flag(self):
         flag = _FLAG_RESPONSE | _FLAG_EVENT | _HESSIAN2_SERIALIZATION_ID
         if self.is_twoway():
@@ -724,6 +856,8 @@ class DubboHeartBeatResponse(_HeartBeat):
 
 
 class DubboResponse(object):
+    __slots__ = ('id', 'status', 'data', 'error')
+
     OK = 20
     UnknownError = 90
 
@@ -734,35 +868,27 @@ class DubboResponse(object):
         self.error = error
 
     def encode(self):
-        stream = BytesIO()
-        self._encode_header(stream)  # 12byte header
-        self._encode_body(stream)  # 4byte body length + body
-        stream.seek(0)
-        try:
-            return stream.read()
-        finally:
-            stream.close()
+        buf = bytearray()
+        self.encode_into(buf)
+        return bytes(buf)
+
+    def encode_into(self, buf):
+        ''' encode message into bytearray buf, replacing its content '''
+        del buf[:]
+        buf += _HEADER_PLACEHOLDER
+        self._encode_body(buf)
+        _HEADER.pack_into(buf, 0, _DUBBO_MAGIC, _FLAG_RESPONSE | _HESSIAN2_SERIALIZATION_ID, self.status, self.id, len(buf) - _HEADER_LENGTH)
 
     @property
     def ok(self):
         return self.status == self.OK
 
-    def _encode_header(self, stream):
-        stream.write(_DUBBO_MAGIC)
-        stream.write(int_to_bytes(_FLAG_RESPONSE | _HESSIAN2_SERIALIZATION_ID))  # flag
-        stream.write(int_to_bytes(self.status))  # status
-        stream.write(long_to_bytes(self.id))
-
-    def _encode_body(self, stream):
-        body = self._get_body()
-        stream.write(int_to_bytes(len(body), 4))
-        stream.write(body)
-
-    def _get_body(self):
+    def _encode_body(self, out):
         if self.error is None:
-            status_byte = self.data is None and int_to_bytes(2 + 0x90) or int_to_bytes(1 + 0x90)
-            return status_byte + encode_object(self.data, 0, [])
-        return encode_object(self.error, 0, [])
+            out += self.data is None and _B_RESPONSE_NULL_VALUE or _B_RESPONSE_VALUE
+            _encode_object(self.data, out, 0, {})
+        else:
+            _encode_object(self.error, out, 0, {})
 
     def __repr__(self):
         return f'id: {self.id}, status: {self.status}, data: {self.data}, error: {self.error}'
@@ -770,7 +896,4 @@ class DubboResponse(object):
 
 def new_object(cls_name, **fields):
     ''' generate a dynamic typed object with specified fields '''
-    cls = namedtuple(cls_name.replace('.', '__DOT__'), fields.keys())
-    cls.__name__ = cls_name
-
-    return cls(**fields)
+    return _get_object_class(cls_name, tuple(fields))(**fields)
@@ -1,3 +1,6 @@
+from . import long
+
+
 JavaList = type('java.util.List', (list, ), {})
 JavaLong = type('java.lang.Long', (long, ), {})
 JavaMap = type('java.util.Map', (dict, ), {})
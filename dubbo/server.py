@@ -1,13 +1,14 @@
 ''' Basic module for Dubbo protocol '''
-import time
+import os
+import socket
+import asyncio
 import logging
 import itertools
-import socket
-from threading import Thread
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote_plus
 from kazoo.client import KazooClient
-from socketserver import ThreadingTCPServer, BaseRequestHandler
-from .utils import get_pub_ip, get_timestamp
+from .utils import get_pub_ip, get_timestamp, UINT64
 from .codec.hessian2 import Decoder, DubboHeartBeatRequest, DubboHeartBeatResponse, DubboResponse
 from .errors import DubboError
 
@@ -15,8 +16,33 @@ from .errors import DubboError
 __all__ = ('DubboService', )
 
 
+logger = logging.getLogger(__name__)
+
+
 _DUBBO_CTRL = b'\x01N'  # control charactors like b'\xda\xbb\xe2\x01\xb0\x01Nnull\r\nelapsed: 0 ms.\r\ndubbo>'
+_DUBBO_MAGIC = b'\xda\xbb'
+_HEADER_LENGTH = 16
+_FLAG_EVENT = 0x20  # heartbeat frames carry the event flag
+_HEARTBEAT_INTERVAL = 60
+_HANDLER_WORKERS = (os.cpu_count() or 1) * 4  # handlers mostly wait on I/O, bound the threads running them
+_MAX_INFLIGHT_REQUESTS = 64  # per connection, stop reading requests when a consumer has this many in progress
 _pid_gen = itertools.count(1)  # process id generator
+_heartbeat_id_gen = itertools.count(1)  # heartbeat ids, unique across connections
+
+
+class _FrameTemplate(object):
+    ''' pre-encoded message of which only the 8 bytes id in header changes '''
+    def __init__(self, msg):
+        frame = msg.encode()
+        self._head = frame[:4]
+        self._tail = frame[12:]
+
+    def encode(self, id_):
+        return self._head + UINT64.pack(id_) + self._tail
+
+
+_HEARTBEAT_REQUEST = _FrameTemplate(DubboHeartBeatRequest(0, twoway=True))
+_HEARTBEAT_RESPONSE = _FrameTemplate(DubboHeartBeatResponse(0))
 
 
 class DubboService(object):
@@ -29,17 +55,25 @@ class DubboService(object):
         self._port = port
         self._app = app
         self._dubbo_version = dubbo_version
-        self._services = {}  # {'service-1': {method1: handler-1, method2: handler-2}}
-        self._server = _ServerThread(_DubboServer(('0.0.0.0', self._port), _get_dubbo_request_handler(self._services)))
+        self._services = {}  # {b'service-1': {b'method1': handler-1, b'method2': handler-2}}, keyed like decoded requests
+        self._methods_csv = {}  # {'service-1': 'method1,method2'}
+        self._url_prefix = f'dubbo://{self._host}:{self._port}/'
+        self._url_query = f'anyhost=true&application={self._app}&dubbo={self._dubbo_version}'
+        self._server = _ServerThread(_bind(('0.0.0.0', self._port)), self._services)
 
     def register(self, zk, version='1.0.0', revision='1.0.0', group=None):
         client = KazooClient(zk)
         client.start()
         grp_field = group and f'group={group}' or ''
-        for service, methods in self._services.items():
-            logging.info(f'register service "{service}", methods "{methods}" to zookeeper "{zk}"')
-            url = f'dubbo://{self._host}:{self._port}/{service}?anyhost=true&application={self._app}&dubbo={self._dubbo_version}{grp_field}&interface={service}&methods={",".join(methods)}&pid={next(_pid_gen)}&revision={revision}&side=provider&timestamp={get_timestamp()}&version={version}'
-            client.ensure_path(f'/dubbo/{service}/providers/{quote_plus(url)}')
+        query = self._url_query + grp_field
+        suffix = f'&revision={revision}&side=provider&timestamp={get_timestamp()}&version={version}'
+        results = []
+        for service, methods in self._methods_csv.items():
+            logger.info('register service "%s", methods "%s" to zookeeper "%s"', service, methods, zk)
+            url = f'{self._url_prefix}{service}?{query}&interface={service}&methods={methods}&pid={next(_pid_gen)}{suffix}'
+            results.append(client.ensure_path_async(f'/dubbo/{service}/providers/{quote_plus(url)}'))
+        for result in results:  # all paths are created concurrently, wait once for them
+            result.get()
 
     def start(self):
         self._server.start()
@@ -48,97 +82,172 @@ class DubboService(object):
         self._server.stop()
 
     def add_method(self, service, method, handler):
-        service_map = self._services.setdefault(service, {})
-        service_map[method] = handler
+        if isinstance(handler, str):  # builtin handler name, e.g. 'void'
+            handler = _BUILTIN_HANDLERS.get(handler)
+        service_map = self._services.setdefault(service.encode(), {})
+        service_map[method.encode()] = handler
+        self._methods_csv[service] = ','.join(name.decode() for name in service_map)
+
+
+def _bind(address):
+    ''' bind the listening socket up front, so a busy port fails on DubboService creation '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # SO_REUSEPORT would let a second service share the port
+    sock.bind(address)
+    return sock
 
 
 class _ServerThread(Thread):
-    def __init__(self, server_instance):
+    ''' serve all connections of a DubboService from one asyncio event loop '''
+    def __init__(self, sock, handler_map):
         super().__init__()
         self.daemon = True
-        self.server = server_instance
+        self._sock = sock
+        self._handler_map = handler_map
+        self._loop = None
+        self._serving = Event()
+        self._connections = set()
 
     def run(self):
-        self.server.serve_forever()
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)  # gather() and asyncio primitives look up the thread's loop
+        self._loop.set_default_executor(ThreadPoolExecutor(_HANDLER_WORKERS, thread_name_prefix='dubbo-handler'))
+        try:
+            server = self._loop.run_until_complete(asyncio.start_server(self._serve, sock=self._sock))
+            self._loop.call_later(_HEARTBEAT_INTERVAL, self._heartbeat)
+        finally:
+            self._serving.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+            tasks = asyncio.all_tasks(self._loop)  # connections and requests in progress
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _serve(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # responses are small, don't wait for Nagle
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)  # detect dead consumers between heartbeats
+        conn = _DubboConnection(reader, writer, self._handler_map)
+        self._connections.add(conn)
+        try:
+            await conn.serve()
+        finally:
+            self._connections.discard(conn)
+
+    def _heartbeat(self):
+        ''' one timer sends heartbeats to every live connection '''
+        logger.debug('send heartbeat msg to %d consumers', len(self._connections))
+        for conn in self._connections:
+            conn.send_heartbeat()
+        self._loop.call_later(_HEARTBEAT_INTERVAL, self._heartbeat)
+
+    def start(self):
+        super().start()
+        self._serving.wait()
 
     def stop(self):
-        self.server.shutdown()
-        self.server.server_close()
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
         self.join()
 
 
-class _DubboServer(ThreadingTCPServer):
-    allow_reuse_address = True
-    daemon_threads = True
+class _DubboConnection(object):
+    ''' serve dubbo requests of one consumer connection, requests are decoded, handled and encoded in the loop's executor '''
+    def __init__(self, reader, writer, handler_map):
+        self._reader = reader
+        self._writer = writer
+        self._handler_map = handler_map
+        self._loop = asyncio.get_running_loop()
+        self._tasks = set()  # requests in progress, the loop only keeps weak references to tasks
+        self._inflight = asyncio.Semaphore(_MAX_INFLIGHT_REQUESTS)
+        self._drain_lock = asyncio.Lock()  # drain() supports a single waiter before python 3.10
 
-    def __init__(self, server_address, request_handler):
-        super().__init__(server_address, request_handler, bind_and_activate=True)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-
-
-def _get_dubbo_request_handler(handler_map):
-    class _DubboRequestHandler(BaseRequestHandler):
-        def __init__(self, request, client_address, server):
-            self._request_id = itertools.count(1)
-            Thread(target=self._heartbeat_loop, daemon=True).start()
-            BaseRequestHandler.__init__(self, request, client_address, server)
-
-        def handle(self):
-            while True:
-                try:
-                    msg = Decoder(self.request).decode()
-                    logging.debug(f'got message {msg}')
-
-                    if isinstance(msg, DubboHeartBeatRequest):  # heartbeat request
-                        self.request.sendall(DubboHeartBeatResponse(msg.id).encode())
-                        continue
-                    elif isinstance(msg, DubboHeartBeatResponse):  # heartbeat response
-                        logging.debug('skip heartbeat response message')
-                        continue
-
-                    handler = handler_map.get(msg.service_name.decode(), {}).get(msg.method_name.decode())
-                    if isinstance(handler, str):  # base string
-                        if hasattr(self, '_' + handler):
-                            handler = getattr(self, '_' + handler)
-                        else:
-                            handler = None
-                    if not handler:
-                        logging.warning(f'no handler for {msg.service_name}.{msg.method_name}')
-                        continue
-                    try:
-                        resp = DubboResponse(msg.id, DubboResponse.OK, handler(*msg.args), None)
-                    except DubboError as err:
-                        resp = DubboResponse(msg.id, err.status, None, err.message)
-                    except EOFError:
-                        raise
-                    except Exception as err:
-                        resp = DubboResponse(msg.id, DubboResponse.UnknownError, None, str(err))
-                    self.request.sendall(resp.encode())
-                except EOFError:
-                    try:
-                        self.request.shutdown(socket.SHUT_RDWR)
-                    except socket.error as err:
-                        logging.debug('error on request shutdown: "%s"' % err)
-                    self.request.close()
-                    break
-
-        def _heartbeat_loop(self):
+    async def serve(self):
+        try:
             while True:
-                time.sleep(60)
-                try:
-                    logging.debug('send heartbeat msg to consumer')
-                    self.request.sendall(DubboHeartBeatRequest(next(self._request_id), twoway=True).encode())
-                except EOFError:
-                    logging.warning('got EOF error, stop heartbeat loop!')
-                    return
-
-        # builtin handlers
-        def _void(self, *args):
-            # do nothing
-            return
-
-        def _empty_ok(self, *args):
-            # response {}
-            return {}
-
-    return _DubboRequestHandler
+                header, body = await self._read_frame()
+                if header[2] & _FLAG_EVENT:  # heartbeat, small enough to decode in the loop
+                    await self._handle_heartbeat(Decoder.decode_frame(header, body))
+                else:
+                    await self._inflight.acquire()  # released by _handle_request
+                    task = self._loop.create_task(self._handle_request(header, body))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+        except (EOFError, asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writer.close()
+
+    async def _read_frame(self):
+        header = await self._reader.readexactly(_HEADER_LENGTH)
+        if header[:2] != _DUBBO_MAGIC:
+            logger.warning('got non dubbo message "%s", close connection', header)
+            raise EOFError
+        body = await self._reader.readexactly(int.from_bytes(header[12:16], 'big'))
+        return header, body
+
+    async def _handle_heartbeat(self, msg):
+        logger.debug('got message %s', msg)  # formatted only when debug is enabled
+        if isinstance(msg, DubboHeartBeatRequest):
+            await self._send(_HEARTBEAT_RESPONSE.encode(msg.id))
+        else:
+            logger.debug('skip heartbeat response message')
+
+    async def _handle_request(self, header, body):
+        try:
+            data = await self._loop.run_in_executor(None, self._process_request, header, body)
+            if data is not None:
+                await self._send(data)
+        except ConnectionError:
+            pass  # consumer is gone, serve() closes the connection
+        except Exception:
+            logger.exception('unable to process request "%s"', header)
+        finally:
+            self._inflight.release()
+
+    def _process_request(self, header, body):
+        ''' decode request, call its handler and encode the response, runs in executor to keep the loop responsive '''
+        msg = Decoder.decode_frame(header, body)
+        logger.debug('got message %s', msg)  # formatted only when debug is enabled
+        handler = self._handler_map.get(msg.service_name, {}).get(msg.method_name)
+        if not handler:
+            logger.warning('no handler for %s.%s', msg.service_name, msg.method_name)
+            return None
+        try:
+            resp = DubboResponse(msg.id, DubboResponse.OK, handler(*msg.args), None)
+        except DubboError as err:
+            resp = DubboResponse(msg.id, err.status, None, err.message)
+        except Exception as err:
+            resp = DubboResponse(msg.id, DubboResponse.UnknownError, None, str(err))
+        return resp.encode()
+
+    def send_heartbeat(self):
+        self._write(_HEARTBEAT_REQUEST.encode(next(_heartbeat_id_gen)))
+
+    async def _send(self, data):
+        ''' write data, wait while the consumer doesn't keep up reading '''
+        self._write(data)
+        async with self._drain_lock:
+            await self._writer.drain()
+
+    def _write(self, data):
+        if not self._writer.is_closing():
+            self._writer.write(data)
+
+
+# builtin handlers
+def _void(*args):
+    # do nothing
+    return
+
+
+def _empty_ok(*args):
+    # response {}
+    return {}
+
+
+_BUILTIN_HANDLERS = {'void': _void, 'empty_ok': _empty_ok}
@@ -2,8 +2,21 @@ import time
 import socket
 import struct
 import hashlib
+import functools
 from datetime import datetime
-from functools import reduce
+
+
+# bigendian fixed width numbers of dubbo header and hessian2, shared by codec and server
+UINT8 = struct.Struct('>B')
+UINT16 = struct.Struct('>H')
+UINT32 = struct.Struct('>I')
+UINT64 = struct.Struct('>Q')
+INT8 = struct.Struct('>b')
+INT16 = struct.Struct('>h')
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+DOUBLE = struct.Struct('>d')
+_SMALL_INT_BYTES = tuple(bytes((num,)) for num in range(0x80))  # same bytes signed or unsigned
 
 
 def bytes_to_long(bs):
@@ -13,25 +26,25 @@ def bytes_to_long(bs):
 
 def long_to_bytes(num):
     ''' convert long to 8 bytes (bigendian) '''
-    return struct.pack('>Q', num)
+    return UINT64.pack(num)
 
 
 def byte(num):
     ''' convert num to one byte int'''
-    return int_to_bytes(int(bin(num)[-8:], 2))
+    return bytes((num & 0xff,))
 
 
 def bytes_to_int(bs, signed=False):
     ''' convert 4 bytes bs to unsigned/signed long integer (bigendian) '''
-    if signed:
-        return int.from_bytes(bs, 'big', signed=True)
-    return reduce(lambda x, y: x * 256 + y, bs)
+    return int.from_bytes(bs, 'big', signed=signed)
 
 
 def int_to_bytes(num, length=None, signed=False):
     ''' convert integer to bytes (bigendian) '''
+    if not length and 0 <= num < 0x80:
+        return _SMALL_INT_BYTES[num]
     if length == 4:
-        return struct.pack(signed and '>i' or '>I', num)
+        return (INT32 if signed else UINT32).pack(num)
 
     int_bytes = None
     if num == 0:
@@ -47,12 +60,12 @@ def int_to_bytes(num, length=None, signed=False):
 
 def double_to_bytes(num):
     ''' convert double to 8 bytes (bigendian) '''
-    return struct.pack('>d', num)
+    return DOUBLE.pack(num)
 
 
 def bytes_to_double(bs):
     ''' convert 8 bytes bs to double (bigendian) '''
-    return struct.unpack('>d', bs)[0]
+    return DOUBLE.unpack(bs)[0]
 
 
 def timestamp_to_datetime(ts):
@@ -61,10 +74,15 @@ def timestamp_to_datetime(ts):
     return datetime.fromtimestamp(ts / 1000)
 
 
+@functools.lru_cache(maxsize=1)
 def get_pub_ip():
+    ''' ip of the interface routing to the internet '''
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.connect(('8.8.8.8', 53))
-    return sock.getsockname()[0]
+    try:
+        sock.connect(('8.8.8.8', 53))  # udp connect only picks the route, nothing is sent
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
 
 
 def get_timestamp():
@@ -72,9 +90,10 @@ def get_timestamp():
 
 
 def iter_directory(*directories):
-    size = len(directories)
-    for idx in range(1, size + 1):
-        yield '/' + '/'.join(directories[:idx])
+    path = ''
+    for directory in directories:
+        path += '/' + directory
+        yield path
 
 
 def md5(data: str) -> str:
@@ -1,5 +1,5 @@
 from io import BytesIO
-from dubbo.codec.hessian2 import Decoder, _desc_to_cls_names, _cls_names_to_desc, encode_object, DubboRequest, DubboResponse, DubboHeartBeatResponse, DubboHeartBeatRequest, new_object
+from dubbo.codec.hessian2 import long, Decoder, _desc_to_cls_names, _cls_names_to_desc, encode_object, DubboRequest, DubboResponse, DubboHeartBeatResponse, DubboHeartBeatRequest, new_object
 from dubbo.java_class import JavaList
 
 
@@ -23,14 +23,14 @@ def test_encode_object():
         'phone_number': '12345678901',
         'engine_result': 'ACCEPT',
         'process_time': '2018-07-30 14:41:04'}) == b'H\x11androidDeviceRootF\x06hardid\x00\x0cphone_number\x0b12345678901\rengine_result\x06ACCEPT\x0cprocess_time\x132018-07-30 14:41:04Z'
-    assert encode_object(new_object('com.xxx.test', a=1, b=2), 0, []) == b'C\x0ccom.xxx.test\x92\x01a\x01b`\x91\x92'
+    assert encode_object(new_object('com.xxx.test', a=1, b=2), 0, {}) == b'C\x0ccom.xxx.test\x92\x01a\x01b`\x91\x92'
     assert encode_object(JavaList([long(2)])) == b'q\x0ejava.util.List\xe2'
     assert encode_object(JavaList([long(2)] * 8)) == b'\x56\x0ejava.util.List\x98\xe2\xe2\xe2\xe2\xe2\xe2\xe2\xe2'
     assert encode_object([2]) == b'y\x92'
 
     child = new_object('child', b=long(2))
     obj = new_object('parent', a=child)
-    assert encode_object(obj, 0, []) == b'C\x06parent\x91\x01a`C\x05child\x91\x01ba\xe2'
+    assert encode_object(obj, 0, {}) == b'C\x06parent\x91\x01a`C\x05child\x91\x01ba\xe2'
 
     assert encode_object(0.0) == b'\x5b'
     assert encode_object(1.0) == b'\x5c'
@@ -40,6 +40,9 @@ def test_encode_object():
     assert encode_object(-1.123) == b'\x5f\xff\xff\xfb\x9d'
     assert encode_object(0.12345) == b'D?\xbf\x9akP\xb0\xf2|'
     assert encode_object(-0.12345) == b'D\xbf\xbf\x9akP\xb0\xf2|'
+    assert encode_object(128.0) == b'\x5e\x00\x80'
+    assert encode_object(-1000000) == b'I\xff\xf0\xbd\xc0'
+    assert encode_object(long(-2 ** 40)) == b'L\xff\xff\xff\x00\x00\x00\x00\x00'
 
 
 def test_decode_object():
@@ -61,6 +64,10 @@ def test_decode_object():
     assert _read_object(b'D?\xbf\x9akP\xb0\xf2|') == 0.12345
     assert _read_object(b'D\xbf\xbf\x9akP\xb0\xf2|') == -0.12345
     assert _read_object(b'YI\x96\x02\xd2') == long(1234567890)
+    assert _read_object(b'I\x00\x04\xf1#') == 323875
+    assert _read_object(b'I\xff\xf0\xbd\xc0') == -1000000
+    assert _read_object(encode_object('a\u4e2d\U0001f600bc')) == 'a\u4e2d\U0001f600bc'
+    assert _read_object(b'L\xff\xff\xff\x00\x00\x00\x00\x00') == long(-2 ** 40)
 
 
 def test_dubbo_bad_response_decode():
@@ -73,10 +80,10 @@ def test_dubbo_bad_response_decode():
 
 
 def test_desc_to_cls_names():
-    assert _desc_to_cls_names('Lcn/com/xxx/SerwVi;VB') == ['cn.com.xxx.SerwVi', 'None', 'bytes']
-    assert _desc_to_cls_names('[[Lcom/bbcc/dd;DLcn/com/xxx/yyy;CS') == ['[[Lcom.bbcc.dd;', 'float', 'cn.com.xxx.yyy', 'chr', 'int']
-    assert _cls_names_to_desc(['cn.com.xxx.SerwVi', 'NoneType', 'bytes']) == 'Lcn/com/xxx/SerwVi;VB'
-    assert _cls_names_to_desc(['[[Lcom.bbcc.dd;', 'float', 'cn.com.xxx.yyy', 'int']) == '[[Lcom/bbcc/dd;DLcn/com/xxx/yyy;I'
+    assert _desc_to_cls_names('Lcn/com/xxx/SerwVi;VB') == ('cn.com.xxx.SerwVi', 'None', 'bytes')
+    assert _desc_to_cls_names('[[Lcom/bbcc/dd;DLcn/com/xxx/yyy;CS') == ('[[Lcom.bbcc.dd;', 'float', 'cn.com.xxx.yyy', 'chr', 'int')
+    assert _cls_names_to_desc(('cn.com.xxx.SerwVi', 'NoneType', 'bytes')) == 'Lcn/com/xxx/SerwVi;VB'
+    assert _cls_names_to_desc(('[[Lcom.bbcc.dd;', 'float', 'cn.com.xxx.yyy', 'int')) == '[[Lcom/bbcc/dd;DLcn/com/xxx/yyy;I'
 
 
 def test_heartbeat_decode():
@@ -124,6 +131,7 @@ def test_new_object():
     assert obj_simple.__class__.__name__ == 'child'
     assert obj_simple.c == 1
     assert obj_simple._fields == ('c', )
+    assert type(new_object('a.b.c.d', a=3, b=4)) is type(obj)
 
 
 def test_heartbeat_encode():
@@ -139,3 +147,12 @@ def test_generic_request_decode():
     assert msg.attachment['generic'] == 'true'
     assert msg.method_name == b'add'
     assert msg.args == [1, 2]
+
+
+def test_object_class_cache():
+    data = b'C\x0ccom.xxx.test\x92\x01a\x01b`\x91\x92'
+    obj = Decoder(BytesIO(data))._read_object()
+    assert obj == (1, 2)
+    assert obj.__class__.__name__ == 'com.xxx.test'
+    assert obj._fields == ('a', 'b')
+    assert type(Decoder(BytesIO(data))._read_object()) is type(obj)
@@ -1,8 +1,16 @@
+import time
+import socket
+import struct
+import pytest
+import asyncio
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from kazoo.exceptions import NodeExistsError
-from dubbo import server
-from dubbo.client import DubboClient
+from dubbo import server, client as client_module
+from dubbo.client import DubboClient, DubboClientPool, AsyncDubboClient
 from dubbo.server import DubboService
 from dubbo.errors import DubboError
+from dubbo.codec.hessian2 import DubboHeartBeatRequest, DubboHeartBeatResponse, DubboRequest, DubboResponse
 
 
 _paths = []
@@ -26,6 +34,18 @@ class _MockKazooClient(object):
             raise NodeExistsError
         _paths.append(path)
 
+    def ensure_path_async(self, path):
+        return _MockAsyncResult(self.ensure_path, path)
+
+
+class _MockAsyncResult(object):
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+
+    def get(self):
+        return self._func(*self._args)
+
 
 def _mock_get_timestamp():
     return 1234567890
@@ -40,6 +60,7 @@ def test_dubbo_register():
     service.register('zk-1.test.corp:2181')
     assert _paths == []
     service.add_method('a.service', 'doGet', 'void')
+    assert callable(service._services[b'a.service'][b'doGet'])  # builtin resolved on registration
     service.register('zk-1.test.corp:2181')
     assert _paths == ['/dubbo/a.service/providers/dubbo%3A%2F%2F10.0.1.120%3A12345%2Fa.service%3Fanyhost%3Dtrue%26application%3Dunit-test%26dubbo%3D2.5.3%26interface%3Da.service%26methods%3DdoGet%26pid%3D1%26revision%3D1.0.0%26side%3Dprovider%26timestamp%3D1234567890%26version%3D1.0.0']
 
@@ -48,29 +69,79 @@ def test_dubbo_register():
     assert _paths == ['/dubbo/a.service/providers/dubbo%3A%2F%2F10.0.1.120%3A12345%2Fa.service%3Fanyhost%3Dtrue%26application%3Dunit-test%26dubbo%3D2.5.3%26interface%3Da.service%26methods%3DdoGet%26pid%3D2%26revision%3D1.0.0%26side%3Dprovider%26timestamp%3D1234567890%26version%3D1.1']
 
 
-def test_dubbo_handler():
-    service = DubboService(12358, 'unittest')
+_PORT = 12358
+_gate = Event()
+
 
-    def _multi_2_handler(num):
-        return num * 2
+def _divide_handler(a, b):
+    if b == 0:
+        raise DubboError(40, 'divide by zero')
+    return a / b
 
-    def _add_handler(a, b):
-        return a + b
 
-    def _exp_handler(num):
-        return num ** 2
+_CALC_HANDLERS = {
+    'multi2': lambda num: num * 2,
+    'add': lambda a, b: a + b,
+    'exp': lambda num: num ** 2,
+    'divide': _divide_handler,
+    'sleep': lambda seconds: time.sleep(seconds) or seconds,
+    'repeat': lambda num, times, factor: [num] * times * factor,
+    'wait': lambda: _gate.wait(5),
+}
 
-    def _divide_handler(a, b):
-        if b == 0:
-            raise DubboError(40, 'divide by zero')
-        return a / b
 
-    service.add_method('calc', 'multi2', _multi_2_handler)
-    service.add_method('calc', 'add', _add_handler)
-    service.add_method('calc', 'exp', _exp_handler)
-    service.add_method('calc', 'divide', _divide_handler)
+@pytest.fixture
+def service():
+    service = DubboService(_PORT, 'unittest')
+    for method, handler in _CALC_HANDLERS.items():
+        service.add_method('calc', method, handler)
     service.start()
-    client = DubboClient('127.0.0.1', 12358)
+    yield service
+    service.stop()
+
+
+@pytest.fixture
+def client(service):
+    with DubboClient('127.0.0.1', _PORT) as client:
+        yield client
+
+
+@pytest.fixture
+def fake_provider():
+    ''' start(script) serves the first connection to a raw socket listener by script(conn), returns the address '''
+    listeners = []
+
+    def _start(script):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        listeners.append(listener)
+
+        def _serve():
+            conn, _ = listener.accept()
+            with conn:
+                script(conn)
+
+        Thread(target=_serve, daemon=True).start()
+        return listener.getsockname()
+
+    yield _start
+    for listener in listeners:
+        listener.close()
+
+
+def _recv_request_id(conn):
+    ''' read one request frame from conn, return its id '''
+    header = conn.recv(16, socket.MSG_WAITALL)
+    conn.recv(int.from_bytes(header[12:], 'big'), socket.MSG_WAITALL)
+    return int.from_bytes(header[4:12], 'big')
+
+
+def _bad_frame(id_):
+    return struct.pack('>2sBBQI', b'\xda\xbb', 0x02, 20, id_, 0)  # response without body
+
+
+def test_dubbo_handler(client):
     assert client.send_request_and_return_response(service_name='calc', method_name='exp', service_version='1.0', args=[4], attachment={}).data == 16
     assert client.send_request_and_return_response(service_name='calc', method_name='multi2', service_version='1.0', args=[4], attachment={}).data == 8
     assert client.send_request_and_return_response(service_name='calc', method_name='divide', args=[3, 2]).data == 1.5
@@ -79,3 +150,201 @@ def test_dubbo_handler():
     assert error_resp.status == 40
     assert error_resp.data is None
     assert error_resp.error == 'divide by zero'
+
+
+def test_dubbo_concurrent_requests(client):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda n: client.send_request_and_return_response(service_name='calc', method_name='exp', args=[n]).data, range(32)))
+    assert results == [n ** 2 for n in range(32)]
+
+
+def test_dubbo_client_pool(service):
+    with DubboClientPool('127.0.0.1', _PORT, size=4) as pool:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda n: pool.send_request_and_return_response(service_name='calc', method_name='exp', args=[n]).data, range(32)))
+        assert results == [n ** 2 for n in range(32)]
+        assert pool.get_for_key('calc.exp') is pool.get_for_key('calc.exp')
+        assert pool.get_for_key('calc.exp').send_request_and_return_response(service_name='calc', method_name='exp', args=[3]).data == 9
+
+
+def test_dubbo_client_pool_connect_error(monkeypatch):
+    clients = []
+
+    class _Client(DubboClient):
+        def __init__(self, *args, **kwargs):
+            if len(clients) == 2:
+                raise ConnectionRefusedError
+            clients.append(self)
+            self._closed = False
+
+        def close(self):
+            self._closed = True
+
+    monkeypatch.setattr(client_module, 'DubboClient', _Client)
+    with pytest.raises(ConnectionRefusedError):
+        DubboClientPool('127.0.0.1', _PORT, size=4)
+    assert [client._closed for client in clients] == [True, True]
+
+
+def test_dubbo_client_close(service):
+    with DubboClient('127.0.0.1', _PORT) as client:
+        assert client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3]).data == 9
+    with pytest.raises(EOFError):
+        client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3])
+
+
+def test_dubbo_client_close_flush(fake_provider):
+    received = bytearray()
+    done = Event()
+
+    def _provider(conn):  # read till EOF, never reply
+        data = conn.recv(65536)
+        while data:
+            received.extend(data)
+            data = conn.recv(65536)
+        done.set()
+
+    with DubboClient(*fake_provider(_provider)) as client:
+        for n in range(200):
+            client.send_request_without_response(service_name='calc', method_name='notify', args=[n])
+    assert done.wait(2)
+    assert bytes(received) == b''.join(DubboRequest(n + 1, False, '2.5.3', 'calc', 'notify', [n]).encode() for n in range(200))
+
+
+def test_dubbo_service_port_in_use(service):
+    with pytest.raises(OSError):
+        DubboService(_PORT, 'unittest')
+
+
+def test_dubbo_service_stop(service, client):
+    assert client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3]).data == 9
+
+    service.stop()
+    with pytest.raises(EOFError):
+        client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3])
+
+
+def test_dubbo_inflight_limit(service, monkeypatch):
+    monkeypatch.setattr(server, '_MAX_INFLIGHT_REQUESTS', 4)
+    _gate.clear()
+    with DubboClient('127.0.0.1', _PORT) as client, ThreadPoolExecutor(max_workers=10) as executor:
+        futures = [executor.submit(client.send_request_and_return_response, service_name='calc', method_name='wait', args=[]) for _ in range(10)]
+        time.sleep(0.3)
+        conn, = service._server._connections
+        assert len(conn._tasks) == 4  # later requests are left unread until one finishes
+        _gate.set()
+        assert [future.result().data for future in futures] == [True] * 10
+
+
+def test_dubbo_heartbeat_during_large_response(service):
+    with socket.create_connection(('127.0.0.1', _PORT)) as consumer, socket.create_connection(('127.0.0.1', _PORT)) as other:
+        consumer.sendall(DubboRequest(1, True, '2.5.3', 'calc', 'repeat', [100000, 400000, 4]).encode())
+        time.sleep(0.05)  # response is being encoded
+        start = time.monotonic()
+        other.sendall(DubboHeartBeatRequest(1, twoway=True).encode())
+        assert other.recv(16, socket.MSG_WAITALL)[:2] == b'\xda\xbb'
+        assert time.monotonic() - start < 0.2  # encoding doesn't block the event loop
+
+
+def test_dubbo_request_timeout(client):
+    with pytest.raises(TimeoutError):
+        client.send_request_and_return_response(service_name='calc', method_name='sleep', args=[0.2], timeout=0.05)
+    assert ('calc', 'sleep') not in client._rtt  # explicit timeout is no rtt sample
+    time.sleep(0.2)
+    assert client.send_request_and_return_response(service_name='calc', method_name='sleep', args=[0.01]).ok
+    assert client._get_timeout(('calc', 'sleep')) == client._timeout  # fast methods keep the default timeout
+    client._update_rtt(('calc', 'slow'), 8)
+    assert client._get_timeout(('calc', 'slow')) > client._timeout
+    for _ in range(10):  # a dead provider keeps timing out
+        client._update_rtt(('calc', 'slow'), client._get_timeout(('calc', 'slow')) * 2)
+    assert client._get_timeout(('calc', 'slow')) == client._max_timeout
+
+
+def test_async_dubbo_client(service):
+    async def _run():
+        async with AsyncDubboClient('127.0.0.1', _PORT) as client:
+            responses = await asyncio.gather(*[client.send_request_and_return_response(service_name='calc', method_name='exp', args=[n]) for n in range(8)])
+            return [resp.data for resp in responses]
+
+    assert asyncio.run(_run()) == [n ** 2 for n in range(8)]
+
+
+def test_async_dubbo_client_close(service):
+    async def _run():
+        client = await AsyncDubboClient('127.0.0.1', _PORT).connect()
+        request = asyncio.ensure_future(client.send_request_and_return_response(service_name='calc', method_name='sleep', args=[1]))
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        await client.close()
+        with pytest.raises(EOFError):
+            await request
+        return time.monotonic() - start
+
+    assert asyncio.run(_run()) < 0.5  # pending request fails at once, not on timeout
+
+
+def test_async_dubbo_client_undecodable_response(fake_provider):
+    def _provider(conn):
+        for replies in (lambda id_: _bad_frame(999) + DubboResponse(id_, 20, 9, None).encode(), _bad_frame, lambda id_: DubboResponse(id_, 20, 4, None).encode()):
+            conn.sendall(replies(_recv_request_id(conn)))
+        conn.recv(1024)
+
+    async def _run():
+        async with AsyncDubboClient(*fake_provider(_provider)) as client:
+            client._timeout = 1
+            assert (await client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3])).data == 9
+            with pytest.raises(EOFError):  # the request whose response can't be decoded fails at once
+                await client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3])
+            # receiving goes on after an undecodable frame
+            assert (await client.send_request_and_return_response(service_name='calc', method_name='exp', args=[2])).data == 4
+
+    asyncio.run(_run())
+
+
+def test_dubbo_large_response(client):
+    # response is larger than client receive buffer
+    assert client.send_request_and_return_response(service_name='calc', method_name='repeat', args=[100000, 200000, 2]).data == [100000] * 400000
+
+
+def test_dubbo_telnet_command(fake_provider):
+    replies = {b'ls\n': b'a.service\r\nb.service\r\ndubbo>', b'ls a.service\n': b'doGet\r\ndubbo>'}
+
+    def _telnet_server(conn):
+        for _ in range(len(replies)):
+            command = conn.recv(1024)
+            for idx in range(0, len(replies[command]), 3):  # reply in fragments
+                conn.sendall(replies[command][idx:idx + 3])
+
+    with DubboClient(*fake_provider(_telnet_server)) as client:
+        assert client.get_services() == ['a.service', 'b.service']
+        assert client.get_methods('a.service') == ['doGet']
+
+
+def test_dubbo_unexpected_command_reply(client, fake_provider):
+    def _telnet_server(conn):
+        conn.sendall(b'a.service\r\ndubbo>b.service\r\ndubbo>')  # replies no command is waiting for
+        conn.recv(1024)
+
+    with DubboClient(*fake_provider(_telnet_server)):
+        time.sleep(0.1)
+        # the shared reactor thread still serves other clients
+        assert client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3], timeout=1).data == 9
+
+
+def test_dubbo_undecodable_response(fake_provider):
+    def _provider(conn):
+        for replies in (lambda id_: _bad_frame(999) + DubboResponse(id_, 20, 9, None).encode(), _bad_frame):
+            conn.sendall(replies(_recv_request_id(conn)))  # frames in one write
+        conn.recv(1024)
+
+    with DubboClient(*fake_provider(_provider)) as client:
+        # a valid response behind an undecodable frame is still dispatched
+        assert client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3], timeout=1).data == 9
+        with pytest.raises(EOFError):  # the request whose response can't be decoded fails at once
+            client.send_request_and_return_response(service_name='calc', method_name='exp', args=[3], timeout=1)
+
+
+def test_heartbeat_templates():
+    assert server._HEARTBEAT_RESPONSE.encode(7) == DubboHeartBeatResponse(7).encode()
+    assert server._HEARTBEAT_RESPONSE.encode(2 ** 40) == DubboHeartBeatResponse(2 ** 40).encode()
+    assert server._HEARTBEAT_REQUEST.encode(7) == DubboHeartBeatRequest(7, twoway=True).encode()